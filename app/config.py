@@ -0,0 +1,43 @@
+import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數。
+from dataclasses import dataclass # 導入 dataclass 裝飾器，用於快速定義只存放設定值的資料類別。
+from functools import lru_cache # 導入 lru_cache 裝飾器，用於快取函數的回傳結果，確保設定只被讀取一次。
+from dotenv import load_dotenv # 從 dotenv 庫導入 load_dotenv 函數，用於從 `.env` 檔案載入環境變數。
+
+
+@dataclass(frozen=True) # `frozen=True` 讓實例在建立後不可修改，避免設定在執行期間被意外覆寫。
+class Settings:
+    """
+    應用程式的集中設定。
+    所有模組都透過 `get_settings()` 取得同一個實例，而不是各自呼叫 `os.getenv()`。
+    """
+    COSMOS_CONNECTION_STRING: str | None # 連接 Azure Cosmos DB 所需的完整連接字串。
+    DB_NAME: str # Cosmos DB 中用於存儲資料的資料庫名稱。
+    APIFY_API_TOKEN: str | None # Apify API 的金鑰（存放於環境變數 THIRD_PARTY_API_KEY）。
+    GOOGLE_PLACES_API_KEY: str | None # Google Places API 的金鑰。
+    AZURE_KEY: str | None # Azure AI Language 服務的訂閱金鑰。
+    AZURE_ENDPOINT: str | None # Azure AI Language 服務的端點 URL。
+    APIFY_WEBHOOK_BASE_URL: str | None # 本服務對外可連線的網址，供 Apify 任務結束時回呼；未設定時僅使用輪詢。
+    REDIS_URL: str | None # Redis 連線網址，用於快取分析結果；未設定時不使用 Redis 快取。
+    SENTIMENT_CACHE_PATH: str | None # 情感分數的 SQLite 快取檔案路徑；未設定時只使用記憶體快取。
+
+
+@lru_cache # 第一次呼叫後結果即被快取，之後的呼叫直接回傳同一個 Settings 實例。
+def get_settings() -> Settings:
+    """
+    載入 `.env` 檔案並回傳應用程式設定。
+    `.env` 只會在第一次呼叫時被解析一次，之後的讀取都直接存取記憶體中的 Settings 物件。
+    Returns:
+        Settings: 包含所有環境變數設定的不可變物件。
+    """
+    load_dotenv() # 自動查找並讀取當前或父目錄下的 `.env` 檔案，將其中的鍵值對載入為環境變數。
+    return Settings(
+        COSMOS_CONNECTION_STRING=os.getenv("COSMOS_CONNECTION_STRING"), # Cosmos DB 連線字串。
+        DB_NAME=os.getenv("DB_NAME", "minesweeper_db"), # 資料庫名稱，未設定時使用預設值 "minesweeper_db"。
+        APIFY_API_TOKEN=os.getenv("THIRD_PARTY_API_KEY"), # 我們約定將第三方（Apify）金鑰存在這個變數名中。
+        GOOGLE_PLACES_API_KEY=os.getenv("GOOGLE_PLACES_API_KEY"), # Google Places API 金鑰。
+        AZURE_KEY=os.getenv("AZURE_LANGUAGE_KEY"), # Azure AI Language 訂閱金鑰。
+        AZURE_ENDPOINT=os.getenv("AZURE_LANGUAGE_ENDPOINT"), # Azure AI Language 端點 URL。
+        APIFY_WEBHOOK_BASE_URL=os.getenv("APIFY_WEBHOOK_BASE_URL"), # 例如 "https://minesweeper.example.com"。
+        REDIS_URL=os.getenv("REDIS_URL"), # 例如 "redis://localhost:6379/0"。
+        SENTIMENT_CACHE_PATH=os.getenv("SENTIMENT_CACHE_PATH"), # 例如 "/app/data/sentiment_cache.sqlite3"。
+    )
@@ -1,40 +1,72 @@
-import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數。
-from pymongo import MongoClient # 從 pymongo 庫導入 MongoClient 類。pymongo 是 Python 中用於 MongoDB 資料庫的驅動程式。這裡使用它來連接 Azure Cosmos DB 的 MongoDB API 介面。
-from dotenv import load_dotenv # 從 dotenv 庫導入 load_dotenv 函數。這個函數用於從 `.env` 檔案中載入環境變數到程式的執行環境中。
+from functools import lru_cache # 導入 lru_cache 裝飾器，用於快取函數的回傳結果，確保資料庫客戶端只被建立一次。
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase # 從 motor 庫導入 AsyncIOMotorClient 類。motor 是建立在 pymongo 之上的非同步 MongoDB 驅動程式，這裡使用它來連接 Azure Cosmos DB 的 MongoDB API 介面，且資料庫操作不會阻塞 FastAPI 的事件迴圈。
+from app.config import get_settings # 從 `app/config.py` 導入 `get_settings`，集中讀取（並快取）所有環境變數設定。
 
-# 載入環境變數
-load_dotenv() # 調用 load_dotenv() 會自動查找並讀取當前或父目錄下的 `.env` 檔案，
-              # 將其中定義的鍵值對載入為環境變數。這樣可以安全地管理敏感資訊，而不將它們硬編碼到程式碼中。
+ANALYZE_JOB_RETENTION_SECONDS = 24 * 60 * 60 # 分析任務文件在 `results` 集合中保留的時間（秒），超過後由資料庫自動刪除。
+COSMOS_RU_HOST_SUFFIX = ".mongo.cosmos.azure.com" # Azure Cosmos DB for MongoDB (RU) 的主機名稱後綴；此版本的 TTL 索引只能建立在 `_ts` 欄位上。
 
-# 從環境變數讀取您的 Cosmos DB 連線字串和您自訂的資料庫名稱
-COSMOS_CONNECTION_STRING = os.getenv("COSMOS_CONNECTION_STRING") # 使用 os.getenv() 函數從環境變數中獲取名為 "COSMOS_CONNECTION_STRING" 的值。
-                                                                 # 這是連接 Azure Cosmos DB 所需的完整連接字串。
-DB_NAME = os.getenv("DB_NAME", "minesweeper_db") # 使用 os.getenv() 函數獲取名為 "DB_NAME" 的環境變數值。
-                                                 # 如果該環境變數不存在，則使用預設值 "minesweeper_db"。
-                                                 # 這是您在 Cosmos DB 中用於存儲資料的資料庫名稱。
 
-# 建立一個全域的資料庫連線客戶端變數，初始設為 None
-client = None
-# 建立一個全域的資料庫實例變數，初始設為 None
-db = None
-
-try:
-    if not COSMOS_CONNECTION_STRING: # 檢查 `COSMOS_CONNECTION_STRING` 是否為空或 None。
+@lru_cache # 第一次呼叫後結果即被快取，之後的呼叫直接回傳同一個資料庫實例（與其背後的連線池）。
+def get_db() -> AsyncIOMotorDatabase:
+    """
+    延遲建立資料庫客戶端，並回傳應用程式使用的資料庫實例。
+    模組匯入時不會建立任何連線；第一次呼叫（通常在 `app/main.py` 的 lifespan 啟動流程中）才會建立客戶端，
+    讓每個 worker 在自己的事件迴圈中建立連線池。客戶端可透過回傳值的 `.client` 屬性取得。
+    Returns:
+        AsyncIOMotorDatabase: Cosmos DB 中的資料庫實例。
+    Raises:
+        ValueError: 如果 COSMOS_CONNECTION_STRING 環境變數未設定。
+    """
+    settings = get_settings() # 取得快取的設定物件。
+    if not settings.COSMOS_CONNECTION_STRING: # 檢查 `COSMOS_CONNECTION_STRING` 是否為空或 None。
         raise ValueError("COSMOS_CONNECTION_STRING 環境變數未設定。") # 如果連接字串未設定，則拋出 `ValueError`。
-    
-    client = MongoClient(COSMOS_CONNECTION_STRING) # 使用獲取到的連接字串創建 `MongoClient` 實例，這會建立與 Azure Cosmos DB 的實際網路連接。
-    db = client[DB_NAME] # 透過 `client` 物件選擇或創建指定的資料庫。如果資料庫在 Cosmos DB 中不存在，它會自動被創建（在第一次寫入數據時）。
-    
-    # 建立我們要使用的集合 (Collections)，類似於傳統資料庫的資料表
-    places_collection = db["places"] # 獲取或創建名為 "places" 的集合。這個集合通常用於存儲地點的詳細資訊。
-    reviews_collection = db["reviews"] # 獲取或創建名為 "reviews" 的集合。這個集合通常用於存儲來自 Apify 抓取的評論數據。
-    
-    # 測試連線，發送一個 'ping' 命令到管理資料庫，如果連線失敗會拋出異常
-    client.admin.command('ping') # 發送一個輕量級命令到資料庫以驗證連接是否活躍。如果連接不成功，這裡會拋出異常。
-    print(f"INFO: 成功連接到 Azure Cosmos DB，資料庫: '{DB_NAME}'。") # 如果 `ping` 命令成功，則打印一條成功連接的資訊日誌。
 
-except Exception as e: # 捕獲在嘗試資料庫連接或操作過程中可能發生的任何異常（例如網路問題、連接字串錯誤、身份驗證失敗等）。
-    print(f"CRITICAL: 資料庫連線失敗！錯誤: {e}") # 打印一個關鍵錯誤訊息，指示資料庫連接失敗的原因。
-    # 在無法連線時，將 collection 設為 None，讓後續程式能判斷資料庫是否可用
-    places_collection = None # 將 `places_collection` 設為 None，表示資料庫服務不可用。
-    reviews_collection = None # 將 `reviews_collection` 設為 None，表示資料庫服務不可用。
\ No newline at end of file
+    # 使用獲取到的連接字串創建 `AsyncIOMotorClient` 實例，並明確設定連線池參數，而非使用 pymongo 的預設值。
+    # 客戶端的建構本身不會阻塞，實際的連線會在背景建立。
+    client = AsyncIOMotorClient(
+        settings.COSMOS_CONNECTION_STRING,
+        maxPoolSize=200, # 連線池的最大連線數，限制對 Cosmos DB 開啟的 socket 數量上限。
+        minPoolSize=10, # 連線池中保持的最少連線數，讓請求可以直接使用已完成 TLS 與身份驗證的熱連線。
+        maxIdleTimeMS=300_000, # 連線閒置超過 5 分鐘後才會被關閉，在重用與資源佔用之間取得平衡。
+        serverSelectionTimeoutMS=5_000, # 最多等待 5 秒選擇可用的伺服器，避免資料庫不可用時請求長時間卡住。
+        waitQueueTimeoutMS=10_000, # 連線池用盡時最多等待 10 秒取得連線，在過載時快速失敗。
+        # 不指定 retryWrites：Cosmos DB 的連接字串帶有 `retrywrites=false`（服務不支援可重試寫入），關鍵字參數會覆蓋連接字串中的設定。
+        compressors="zstd,snappy" # 啟用網路傳輸壓縮（若伺服器支援），減少傳輸的位元組數。
+    )
+    # 透過 `client` 物件選擇或創建指定的資料庫（預設為 "minesweeper_db"）。如果資料庫在 Cosmos DB 中不存在，它會自動被創建（在第一次寫入數據時）。
+    return client[settings.DB_NAME]
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> None:
+    """
+    建立快取查詢所需的索引（若已存在則不會重複建立）。
+    `places` 集合以 `_id` (即 place_id) 查詢，MongoDB 會自動為 `_id` 建立索引，因此只需處理 `reviews` 集合。
+    `reviews` 集合以 (place_id, reviewId) 建立唯一索引，同一地點的評論即使被多個分析任務同時寫入也不會重複儲存。
+    另外為 `results` 集合建立 TTL 索引，讓已結束（或遺失）的分析任務文件不會無限累積。
+    索引只是效能與資料清理的輔助：任一索引建立失敗只會記錄警告，不影響其他索引與資料庫的使用。
+    Args:
+        db (AsyncIOMotorDatabase): 由 `get_db()` 取得的資料庫實例。
+    """
+    connection_string = get_settings().COSMOS_CONNECTION_STRING or ""
+    if COSMOS_RU_HOST_SUFFIX in connection_string:
+        # Cosmos DB (RU) 只接受 `_ts`（文件最後修改時間）上的 TTL 索引：任務文件在最後一次更新後 ANALYZE_JOB_RETENTION_SECONDS 秒被刪除。
+        results_ttl_index = [("_ts", 1)]
+    else:
+        # 其他 MongoDB 相容服務：任務文件在建立 ANALYZE_JOB_RETENTION_SECONDS 秒後被自動刪除。
+        results_ttl_index = [("created_at", 1)]
+
+    indexes = [
+        # 在 reviews 集合的 `place_id` 欄位上建立索引，讓快取查詢使用索引而非掃描整個集合。
+        ("reviews", [("place_id", 1)], {}),
+        # (place_id, reviewId) 唯一索引：Apify 為每則評論提供 reviewId，重複寫入的評論會被資料庫拒絕。
+        ("reviews", [("place_id", 1), ("reviewId", 1)], {"unique": True}),
+        # 在 results 集合的 `place_id` 欄位上建立索引，讓 POST /analyze 能快速找到同一地點處理中的任務。
+        ("results", [("place_id", 1)], {}),
+        # results 集合的 TTL 索引。
+        ("results", results_ttl_index, {"expireAfterSeconds": ANALYZE_JOB_RETENTION_SECONDS}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e: # 例如 Cosmos DB 不支援的索引類型，或已有資料的集合無法建立唯一索引。
+            print(f"WARNING: 無法在 {collection} 集合建立索引 {keys}: {e}")
@@ -1,51 +1,145 @@
-from fastapi import FastAPI, HTTPException, Query # 導入 FastAPI 核心類，用於創建 Web API 應用。
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks # 導入 FastAPI 核心類，用於創建 Web API 應用。
                                                   # 導入 HTTPException，用於在 API 請求處理中拋出 HTTP 錯誤。
                                                   # 導入 Query，用於在路由函數中定義查詢參數。
+                                                  # 導入 BackgroundTasks，用於在回應送出後於背景執行分析任務。
+from fastapi.responses import Response # 導入 Response，用於直接回傳已序列化的內容。
 from fastapi.staticfiles import StaticFiles # 導入 StaticFiles，用於在 FastAPI 應用中服務靜態文件（如 HTML、CSS、JavaScript）。
-from pydantic import BaseModel # 導入 Pydantic 的 BaseModel，用於定義數據模型，實現請求體驗證和回應序列化。
+from pydantic import BaseModel, TypeAdapter # 導入 Pydantic 的 BaseModel，用於定義數據模型，實現請求體驗證和回應序列化；TypeAdapter 用於直接將列表序列化為 JSON。
 import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數和處理文件路徑。
-import requests # 導入 requests 庫，這是一個流行的 Python 庫，用於發送 HTTP 請求（例如到 Apify 或 Google Places API）。
-import time # 導入 time 模組，提供時間相關的功能，例如 `time.sleep()` 用於暫停程式執行。
-import json # 導入 json 模組，用於處理 JSON 格式的數據。
-from dotenv import load_dotenv # 導入 load_dotenv，用於從 `.env` 檔案載入環境變數。
+import httpx # 導入 httpx 庫，提供非同步的 HTTP 客戶端，用於發送 HTTP 請求（例如到 Apify 或 Google Places API）而不阻塞事件迴圈。
+import ijson # 導入 ijson，一個串流式 JSON 解析器，用於邊下載邊解析 Apify 數據集，而不需先將整個回應緩衝在記憶體中。
+import orjson # 導入 orjson，一個以 Rust 實作的高效能 JSON 庫，用於解析 Apify / Google 回傳的 JSON 數據。
+import base64 # 導入 base64 模組，用於編碼傳給 Apify 的臨時 webhook 設定。
+import uuid # 導入 uuid 模組，用於為每次 Apify 任務與分析任務產生唯一的識別鍵。
+from datetime import datetime, timedelta, timezone # 導入 datetime，用於記錄分析任務的建立時間並判斷任務是否逾時。
+import asyncio # 導入 asyncio 模組，提供 `asyncio.sleep()` 等非阻塞的等待功能，以及同時執行多個協程的 `asyncio.gather()`。
+from pymongo.errors import BulkWriteError, DuplicateKeyError # 導入寫入重複鍵時的例外，用於處理同一地點的多個分析任務同時寫入。
+from redis.asyncio import Redis # 導入 redis 的非同步客戶端，用於在 Cosmos DB 之前快取分析結果。
+from cachetools import TTLCache # 導入 TTLCache，一個有容量上限且項目會過期的字典，用於快取 /search 的結果。
+from contextlib import asynccontextmanager, aclosing, suppress # 導入 asynccontextmanager，用於定義 FastAPI 的 lifespan（啟動/關閉）處理器；aclosing 用於確保提前結束的非同步產生器會被關閉；suppress 用於忽略取消背景任務時的例外。
+from typing import AsyncIterator # 導入 AsyncIterator，用於標註非同步產生器的回傳型別。
+from app.config import get_settings # 從 `app/config.py` 導入 `get_settings`，集中讀取（並快取）所有環境變數設定。
 
 # --- 1. 初始化與設定 ---
-load_dotenv() # 調用 load_dotenv()，自動查找並載入專案根目錄下的 `.env` 檔案，將其中的變數載入到 os.environ 中。
-              # 這使得應用程式可以安全地讀取 API 金鑰、資料庫連接字串等敏感資訊。
+settings = get_settings() # 取得快取的設定物件。`.env` 檔案只會在第一次呼叫時被解析，之後皆直接讀取記憶體。
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    應用程式的生命週期處理器。
+    在啟動時建立共用的 HTTP 客戶端、建立並驗證資料庫連線，在關閉時釋放這些連線資源。
+    所有步驟都是非同步的，不會在 worker 啟動時阻塞事件迴圈。
+    """
+    global places_collection, reviews_collection, results_collection, _http, _redis # 需要修改模組層級的集合變數、HTTP 客戶端與 Redis 客戶端。
+    # 建立整個應用程式共用的非同步 HTTP 客戶端，讓對 Apify 和 Google 的請求可以重用已建立的 TCP/TLS 連線。
+    _http = httpx.AsyncClient(
+        timeout=30.0, # 每個請求的逾時時間為 30 秒。
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50) # 限制連線池大小：最多保留 20 條閒置連線，總共最多 50 條連線。
+    )
+    if settings.REDIS_URL: # 設定了 Redis 時才建立客戶端；實際連線會在第一次使用時建立。
+        _redis = Redis.from_url(settings.REDIS_URL)
+    db = None # 資料庫實例，建立失敗時保持為 None。
+    try:
+        db = get_db() # 第一次呼叫時才建立資料庫客戶端（之後的呼叫回傳同一個實例）。
+        await db.client.admin.command('ping') # 發送 'ping' 命令非同步地驗證連線，如果連線失敗會拋出異常。
+        # 連線成功後，才讓我們要使用的集合 (Collections) 可供路由使用，類似於傳統資料庫的資料表
+        places_collection = db["places"] # 存儲地點詳細資訊的集合。
+        reviews_collection = db["reviews"] # 存儲來自 Apify 抓取的評論數據的集合。
+        results_collection = db["results"] # 存儲背景分析任務狀態與結果的集合，以任務 ID 為 `_id`。
+        print(f"INFO: 成功連接到 Azure Cosmos DB，資料庫: '{db.name}'。") # 如果 `ping` 命令成功，則打印一條成功連接的資訊日誌。
+    except Exception as e: # 捕獲連接字串未設定、網路問題、身份驗證失敗等異常。
+        # 在無法連線時，集合保持為 None，讓後續程式能判斷資料庫是否可用
+        print(f"CRITICAL: 資料庫連線失敗！錯誤: {e}") # 打印一個關鍵錯誤訊息，指示資料庫連接失敗的原因。
+    if places_collection is not None:
+        # 確保快取查詢所需的索引存在。索引建立失敗不代表資料庫不可用，因此不在上面的連線檢查中執行。
+        try:
+            await ensure_indexes(db)
+        except Exception as e:
+            print(f"WARNING: 建立資料庫索引失敗: {e}")
+    yield # 應用程式在此開始處理請求。
+    await _http.aclose() # 應用程式關閉時，關閉共用的 HTTP 客戶端。
+    if _redis is not None:
+        await _redis.aclose() # 關閉 Redis 客戶端的連線池。
+    if db is not None:
+        db.client.close() # 關閉資料庫客戶端，釋放連線池中的所有連線。
 
 app = FastAPI( # 創建一個 FastAPI 應用程式實例。
     title="Project MineSweeper - 美食地標防雷系統 API", # 設定在自動生成的 API 文件（如 Swagger UI）中顯示的應用標題。
     description="輸入一個地點名稱，獲取其量化的踩雷分數與分析報告。", # 設定 API 文件的簡短描述。
-    version="2.0.0" # 設定 API 的版本號。此處版本升級，代表已加入 AI 功能。
+    version="2.0.0", # 設定 API 的版本號。此處版本升級，代表已加入 AI 功能。
+    lifespan=lifespan # 指定生命週期處理器，在啟動時驗證資料庫連線。
+    # 不指定 default_response_class：宣告了 `response_model` 的路由由 Pydantic 直接序列化為 JSON bytes，不需要 ORJSONResponse（新版 FastAPI 已將其標記為棄用）。
 )
 
 # --- 2. 匯入與初始化核心模組 ---
 # 將 import 放在這裡，確保在 app 建立後再引入。這有助於避免潛在的循環依賴問題，並確保模組在應用程式環境初始化後才被載入。
-from app.services import FeatureEngineer # 從 `app/services.py` 導入 `FeatureEngineer` 類，用於特徵工程。
+from app.services import FeatureEngineer, MATERIALIZED_REVIEW_FIELDS # 從 `app/services.py` 導入 `FeatureEngineer` 類（用於特徵工程）及預先計算並儲存的評論特徵欄位名稱。
 from app.models import LandmineScorer # 從 `app/models.py` 導入 `LandmineScorer` 類，用於計算踩雷分數。
-from app.database import places_collection, reviews_collection # 從 `app/database.py` 導入 `places_collection` 和 `reviews_collection`，它們是 MongoDB (Cosmos DB) 的集合實例。
+from app.database import get_db, ensure_indexes # 從 `app/database.py` 導入 `get_db`（延遲建立 MongoDB (Cosmos DB) 的資料庫實例）與 `ensure_indexes`（建立索引）。
 
+# MongoDB (Cosmos DB) 的集合實例，在 lifespan 啟動流程中連線成功後才會被設定；為 None 表示資料庫服務不可用。
+places_collection = None
+reviews_collection = None
+results_collection = None
+
+# 在模組匯入時建立（而非在 lifespan 中），讓 `gunicorn --preload` 只在主程序中載入一次關鍵字詞庫與自動機，
+# fork 出的 worker 以 copy-on-write 共用這些唯讀物件。資料庫、HTTP 與 Redis 客戶端則在各 worker 的 lifespan 中建立。
 engineer = FeatureEngineer() # 初始化 `FeatureEngineer` 類的一個實例。
 scorer = LandmineScorer() # 初始化 `LandmineScorer` 類的一個實例。
 
-# --- 3. 讀取環境變數 ---
-APIFY_API_TOKEN = os.getenv("THIRD_PARTY_API_KEY") # 從環境變數中獲取 Apify API 的金鑰。
-GOOGLE_PLACES_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY") # 從環境變數中獲取 Google Places API 的金鑰。
+# --- 3. 讀取設定 ---
+APIFY_API_TOKEN = settings.APIFY_API_TOKEN # 從集中設定中獲取 Apify API 的金鑰。
+GOOGLE_PLACES_API_KEY = settings.GOOGLE_PLACES_API_KEY # 從集中設定中獲取 Google Places API 的金鑰。
 BASE_API_URL = "https://api.apify.com/v2" # 定義 Apify API 的基礎 URL。
+# 從快取讀取評論時只取回特徵工程需要的欄位；評論文件中其餘的中繼資料（評論者資訊、圖片等）不需要經過網路傳輸。
+# 預先計算並儲存的特徵（情感分數、關鍵字計數及其版本）也一併取回，讓快取命中時不需要再呼叫 Azure 或重新計算關鍵字。
+REVIEW_PROJECTION = {"text": 1, "stars": 1, "publishedAtDate": 1, "_id": 0, **{field: 1 for field in MATERIALIZED_REVIEW_FIELDS}}
+# /search 結果的快取：查詢字串 -> 已序列化的候選地點列表 (JSON bytes)。最多保留 1024 筆，每筆 1 小時後過期。
+# 所有存取都在事件迴圈的同一個執行緒中進行，因此不需要額外加鎖；同一查詢同時未命中時最多只會重複查詢一次 Google。
+_search_cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+APIFY_WEBHOOK_BASE_URL = settings.APIFY_WEBHOOK_BASE_URL # 本服務對外可連線的網址，設定後 Apify 任務結束時會主動通知我們。
+_http: httpx.AsyncClient | None = None # 共用的非同步 HTTP 客戶端，在 lifespan 啟動時建立。
+_apify_run_events: dict[str, asyncio.Event] = {} # 等待中的 Apify 任務：webhook 識別鍵 -> 任務結束時被設定的 asyncio.Event。
+# 以多個 worker 執行時，webhook 可能由任一 worker 接收，而上面的事件只存在於發起任務的 worker 中。
+# 設定了 REDIS_URL 時，webhook 通知會透過 Redis 發布/訂閱轉送到發起任務的 worker；未設定時只有單一 worker 能可靠地收到通知，
+# 其餘情況會退回一般輪詢（仍能得到正確結果，只是較慢）。
+APIFY_WEBHOOK_CHANNEL = "apify-run:{run_key}" # 轉送 webhook 通知的 Redis 頻道名稱。
+APIFY_POLL_MAX_DELAY = 15.0 # 輪詢 Apify 任務狀態的最長間隔（秒）。
+_redis: Redis | None = None # 分析結果的 Redis 快取客戶端，在 lifespan 啟動時建立；未設定 REDIS_URL 時為 None。
+ANALYZE_CACHE_TTL = 3600 # 分析結果在 Redis 中的保存時間（秒）。
+# 分析任務停留在 PENDING 的最長時間。超過後視為遺失（例如 worker 在執行途中重新啟動，或寫入結果失敗），查詢時會回報 FAILED。
+ANALYZE_JOB_TIMEOUT = timedelta(minutes=10)
 
 # --- 4. 輔助函式：Apify 數據抓取 ---
-def _run_apify_actor_and_get_data(place_id: str) -> dict | None:
+async def _listen_apify_webhook(pubsub, run_finished: asyncio.Event) -> None:
+    """
+    (內部輔助函式) 將透過 Redis 轉送的 webhook 通知轉為本程序的完成事件，直到被取消為止。
+    Redis 連線中斷等錯誤只會記錄警告並停止轉送，等待中的任務仍可透過輪詢得知任務結束。
+    Args:
+        pubsub: 已訂閱這次任務頻道的 Redis PubSub 物件。
+        run_finished (asyncio.Event): 這次任務的完成事件。
+    """
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message": # 忽略訂閱確認等控制訊息。
+                run_finished.set()
+    except Exception as e:
+        print(f"WARNING: Redis webhook 通知訂閱中斷，將只使用輪詢: {e}")
+
+async def _run_apify_actor(place_id: str) -> str:
     """
-    (內部輔助函式) 根據 Google Place ID 執行 Apify Actor 抓取數據並直接回傳結果。
-    這個函數會啟動一個 Apify 任務，輪詢其狀態，並在任務成功後下載數據。
+    (內部輔助函式) 根據 Google Place ID 執行 Apify Actor 抓取數據，並回傳結果所在的數據集 ID。
+    這個函數會啟動一個 Apify 任務，以指數退避 (1, 2, 4, 8, 15, 15... 秒) 輪詢其狀態，直到任務結束。
+    數據本身由 `_iter_apify_dataset` 以串流方式讀取。
+    若設定了 APIFY_WEBHOOK_BASE_URL，任務結束時 Apify 會呼叫 `/apify-webhook/{run_key}`，讓等待立即結束。
     Args:
         place_id (str): Google 地點的唯一識別符。
     Returns:
-        dict | None: 抓取到的地點數據字典（包含評論），如果 Apify 任務失敗則為 None。
+        str: 任務生成的 Apify 數據集 ID。
     Raises:
         ValueError: 如果 APIFY_API_TOKEN 未設定。
         RuntimeError: 如果 Apify 任務未能成功完成。
-        requests.exceptions.RequestException: 如果與 Apify API 的 HTTP 請求失敗。
+        httpx.HTTPError: 如果與 Apify API 的 HTTP 請求失敗。
     """
     actor_id = "compass~crawler-google-places" # 定義要使用的 Apify Actor ID，這是 Google Places 爬蟲的 ID。
     if not APIFY_API_TOKEN: # 檢查 Apify API 金鑰是否已設置。
@@ -59,30 +153,96 @@ def _run_apify_actor_and_get_data(place_id: str) -> dict | None:
         "language": "zh-TW" # 指定抓取評論的語言為繁體中文。
     }
     
+    params = {"token": APIFY_API_TOKEN} # 啟動 Actor 任務時附帶的查詢參數。
+    run_key = uuid.uuid4().hex # 本次任務的 webhook 識別鍵。任務 ID 要等啟動後才知道，因此使用我們自己產生的鍵。
+    if APIFY_WEBHOOK_BASE_URL: # 如果設定了對外網址，則為這次任務註冊一個臨時 webhook。
+        webhooks = [{
+            "eventTypes": ["ACTOR.RUN.SUCCEEDED", "ACTOR.RUN.FAILED", "ACTOR.RUN.TIMED_OUT", "ACTOR.RUN.ABORTED"], # 任務進入任一最終狀態時觸發。
+            "requestUrl": f"{APIFY_WEBHOOK_BASE_URL.rstrip('/')}/apify-webhook/{run_key}" # Apify 將 POST 到這個網址。
+        }]
+        params["webhooks"] = base64.b64encode(orjson.dumps(webhooks)).decode() # Apify 要求 webhook 設定以 Base64 編碼的 JSON 傳遞。
+    run_finished = _apify_run_events[run_key] = asyncio.Event() # 建立並登記這次任務的完成事件。
+    pubsub = listener = None # Redis 訂閱與轉送 webhook 通知的背景任務。
+    if APIFY_WEBHOOK_BASE_URL and _redis is not None: # 在啟動任務前訂閱，確保不會錯過其他 worker 轉送的通知。
+        try:
+            pubsub = _redis.pubsub()
+            await pubsub.subscribe(APIFY_WEBHOOK_CHANNEL.format(run_key=run_key))
+            listener = asyncio.create_task(_listen_apify_webhook(pubsub, run_finished))
+        except Exception as e: # Redis 無法使用時只記錄警告，仍可透過輪詢得知任務結束。
+            print(f"WARNING: 訂閱 Redis webhook 通知失敗，將只使用輪詢: {e}")
+
     print(f"INFO: 啟動 Apify Actor 抓取 Place ID '{place_id}' 的數據...") # 打印日誌訊息，指示 Apify 任務即將啟動。
-    run_response = requests.post(f"{BASE_API_URL}/acts/{actor_id}/runs?token={APIFY_API_TOKEN}", json=actor_input) # 向 Apify API 發送 POST 請求以啟動 Actor 任務。
-    run_response.raise_for_status() # 檢查 HTTP 回應狀態碼。如果請求失敗（4xx 或 5xx），則拋出異常。
-    run_data = run_response.json()['data'] # 解析回應的 JSON 數據，提取任務運行相關資訊。
-    run_id, dataset_id = run_data['id'], run_data['defaultDatasetId'] # 提取運行 ID 和任務生成數據集的 ID。
-    print(f"INFO: 任務已啟動，Run ID: {run_id}") # 打印任務的運行 ID。
-
-    while True: # 進入循環，定期輪詢 Apify 任務的狀態。
-        status_response = requests.get(f"{BASE_API_URL}/acts/{actor_id}/runs/{run_id}?token={APIFY_API_TOKEN}") # 發送 GET 請求查詢任務狀態。
-        status_response.raise_for_status() # 檢查狀態查詢請求的回應是否成功。
-        status = status_response.json()['data']['status'] # 從回應中提取任務的當前狀態字串。
-        print(f"INFO: 當前任務狀態: {status}") # 打印當前任務狀態。
-        if status in ["SUCCEEDED", "FAILED", "TIMED-OUT", "ABORTED"]: # 如果任務狀態是最終狀態（成功、失敗、超時、中止），則跳出循環。
-            break
-        time.sleep(15) # 暫停 15 秒，避免頻繁請求 Apify API。
+    try:
+        run_response = await _http.post(f"{BASE_API_URL}/acts/{actor_id}/runs", params=params, json=actor_input) # 向 Apify API 發送 POST 請求以啟動 Actor 任務。
+        run_response.raise_for_status() # 檢查 HTTP 回應狀態碼。如果請求失敗（4xx 或 5xx），則拋出異常。
+        run_data = orjson.loads(run_response.content)['data'] # 解析回應的 JSON 數據，提取任務運行相關資訊。
+        run_id, dataset_id = run_data['id'], run_data['defaultDatasetId'] # 提取運行 ID 和任務生成數據集的 ID。
+        print(f"INFO: 任務已啟動，Run ID: {run_id}") # 打印任務的運行 ID。
+
+        delay = 1.0 # 第一次重新查詢前等待 1 秒，之後每次加倍，最多 APIFY_POLL_MAX_DELAY 秒。
+        while True: # 進入循環，查詢 Apify 任務的狀態。
+            status_response = await _http.get(f"{BASE_API_URL}/acts/{actor_id}/runs/{run_id}?token={APIFY_API_TOKEN}") # 發送 GET 請求查詢任務狀態。
+            status_response.raise_for_status() # 檢查狀態查詢請求的回應是否成功。
+            status = orjson.loads(status_response.content)['data']['status'] # 從回應中提取任務的當前狀態字串。
+            print(f"INFO: 當前任務狀態: {status}") # 打印當前任務狀態。
+            if status in ["SUCCEEDED", "FAILED", "TIMED-OUT", "ABORTED"]: # 如果任務狀態是最終狀態（成功、失敗、超時、中止），則跳出循環。
+                break
+            try:
+                # 等待 webhook 通知，最多等待 `delay` 秒；逾時則回退為一般輪詢。等待期間事件迴圈可以繼續處理其他請求。
+                await asyncio.wait_for(run_finished.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            run_finished.clear() # 清除事件，確保下一輪仍會等待（避免狀態尚未更新時連續空轉）。
+            delay = min(delay * 2, APIFY_POLL_MAX_DELAY) # 指數退避：延長下一次的等待時間。
+    finally:
+        _apify_run_events.pop(run_key, None) # 無論成功與否，都移除這次任務的完成事件。
+        if listener is not None:
+            listener.cancel() # 停止轉送通知，並等待背景任務結束。
+            with suppress(asyncio.CancelledError):
+                await listener
+        if pubsub is not None:
+            try:
+                await pubsub.unsubscribe() # 取消訂閱。
+            except Exception as e:
+                print(f"WARNING: 取消 Redis 訂閱失敗: {e}")
+            try:
+                await pubsub.aclose() # 即使取消訂閱失敗，也要關閉訂閱使用的連線。
+            except Exception as e:
+                print(f"WARNING: 關閉 Redis 訂閱失敗: {e}")
 
     if status == "SUCCEEDED": # 如果任務成功完成。
         print("INFO: 任務成功！下載數據...") # 打印成功訊息。
-        dataset_response = requests.get(f"{BASE_API_URL}/datasets/{dataset_id}/items?token={APIFY_API_TOKEN}") # 從 Apify 數據集下載抓取到的數據。
-        dataset_response.raise_for_status() # 檢查數據下載請求的回應是否成功。
-        return dataset_response.json() # 回傳 JSON 格式的數據。
+        return dataset_id # 回傳數據集 ID，由呼叫端以串流方式讀取。
     else: # 如果任務未能成功完成。
         raise RuntimeError(f"Apify 任務未能成功完成，最終狀態為: {status}") # 拋出運行時錯誤，指示任務失敗原因。
 
+
+async def _iter_apify_dataset(dataset_id: str) -> AsyncIterator[dict]:
+    """
+    (內部輔助函式) 以串流方式下載並逐筆產出 Apify 數據集中的項目。
+    回應內容一邊下載一邊交給 ijson 解析，記憶體中只會保留目前正在組裝的項目，
+    而不是整個回應（在調高 maxReviews 時可能達到數十 MB）。呼叫端提前停止迭代時，下載也會跟著中止。
+    Args:
+        dataset_id (str): `_run_apify_actor` 回傳的數據集 ID。
+    Yields:
+        dict: 數據集中的單一項目（例如一個地點及其評論）。
+    Raises:
+        httpx.HTTPError: 如果數據下載請求失敗。
+    """
+    events = ijson.sendable_list() # ijson 推送式解析器的輸出緩衝區，每送入一段位元組就會收集到解析完成的項目。
+    # 解析頂層陣列中的每個元素（前綴 "item"）。`use_float=True` 讓數字解析為 float 而非 Decimal，才能直接寫入資料庫。
+    parser = ijson.items_coro(events, "item", use_float=True)
+    async with _http.stream("GET", f"{BASE_API_URL}/datasets/{dataset_id}/items", params={"token": APIFY_API_TOKEN}) as response:
+        response.raise_for_status() # 檢查數據下載請求的回應是否成功。
+        async for chunk in response.aiter_bytes(): # 逐段讀取回應內容。
+            parser.send(chunk) # 將這段位元組交給解析器。
+            for item in events: # 產出這段位元組中解析完成的項目。
+                yield item
+            del events[:] # 清空緩衝區，已產出的項目不再保留。
+    parser.close() # 通知解析器數據已結束（若 JSON 不完整會在此拋出錯誤）。
+    for item in events: # 產出最後一段中剩餘的項目。
+        yield item
+
 # --- 5. API 路由定義 ---
 # Pydantic 模型：定義 /search 端點回應的單個地點候選對象結構。
 class PlaceCandidate(BaseModel):
@@ -90,6 +250,9 @@ class PlaceCandidate(BaseModel):
     address: str # 地點的格式化地址。
     place_id: str # 地點的 Google Place ID。
 
+# 以 `PlaceCandidate` 的結構直接將字典列表序列化為 JSON，不需為每個候選地點建立模型實例。
+_candidate_adapter = TypeAdapter(list[PlaceCandidate])
+
 # Pydantic 模型：定義 /analyze 端點請求的輸入結構。
 class AnalyzeRequest(BaseModel):
     place_id: str # 請求體中必須包含的地點 ID。
@@ -104,9 +267,21 @@ class AnalyzeResponse(BaseModel):
     positive_points: list[str] # 從評論中摘錄的正面提及片語列表。
     details: dict # 包含更多詳細數據（如歷史平均分、近期平均分、評論總數、趨勢分數）的字典。
 
+# Pydantic 模型：定義 POST /analyze 端點接受任務後的回應結構。
+class AnalyzeJobAccepted(BaseModel):
+    job_id: str # 分析任務的唯一識別碼。
+    status_url: str # 查詢任務狀態與結果的 URL。
+
+# Pydantic 模型：定義 GET /analyze/{job_id} 端點回應的任務狀態結構。
+class AnalyzeJobStatus(BaseModel):
+    job_id: str # 分析任務的唯一識別碼。
+    status: str # 任務狀態："PENDING"（處理中）、"SUCCEEDED"（成功）或 "FAILED"（失敗）。
+    result: AnalyzeResponse | None = None # 任務成功時的分析結果。
+    error: str | None = None # 任務失敗時的錯誤訊息。
+
 # /search 端點：用於模糊搜尋地點並回傳候選列表。
-@app.get("/search", response_model=list[PlaceCandidate]) # 定義一個 GET 請求的 API 端點，路徑為 "/search"。
-                                                            # `response_model` 指定了這個端點將回傳 `PlaceCandidate` 對象的列表。
+@app.get("/search", responses={200: {"model": list[PlaceCandidate]}}) # 定義一個 GET 請求的 API 端點，路徑為 "/search"。
+                                                                     # 回傳已序列化的 `PlaceCandidate` 列表；`responses` 僅用於 API 文件，FastAPI 不會再次驗證或序列化回應。
 async def search_places(query: str = Query(..., min_length=2, description="模糊搜尋關鍵字")):
     """
     模糊搜尋 Google Places API 以獲取地點候選列表。
@@ -115,6 +290,10 @@ async def search_places(query: str = Query(..., min_length=2, description="模
     if not GOOGLE_PLACES_API_KEY: # 檢查 Google Places API 金鑰是否已設置。
         raise HTTPException(status_code=503, detail="Google Places API 金鑰未設定。") # 如果未設置，則拋出 503 服務不可用錯誤。
 
+    cached = _search_cache.get(query) # 先查詢快取，相同的查詢字串在 1 小時內不會再次呼叫 Google Places API。
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
     url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json" # Google Places API 的 `findplacefromtext` 端點 URL。
     params = { # 定義發送給 Google Places API 的查詢參數。
         "input": query, # 搜尋的輸入文字。
@@ -123,70 +302,164 @@ async def search_places(query: str = Query(..., min_length=2, description="模
         "key": GOOGLE_PLACES_API_KEY, # Google Places API 金鑰。
         "language": "zh-TW" # 指定搜尋結果的語言為繁體中文。
     }
-    response = requests.get(url, params=params) # 發送 GET 請求到 Google Places API。
+    response = await _http.get(url, params=params) # 透過共用的非同步客戶端發送 GET 請求到 Google Places API。
     response.raise_for_status() # 檢查 HTTP 回應狀態碼。如果請求失敗，則拋出異常。
-    data = response.json() # 解析回應的 JSON 數據。
+    data = orjson.loads(response.content) # 以 orjson 解析回應的 JSON 數據。
     
-    # 遍歷回應數據中的 'candidates' 列表，為每個候選地點創建一個 `PlaceCandidate` 對象。
-    # `res.get("name")` 安全地獲取字段值，避免鍵錯誤。
-    return [
-        PlaceCandidate(name=res.get("name"), address=res.get("formatted_address"), place_id=res.get("place_id"))
+    # 遍歷回應數據中的 'candidates' 列表，將每個候選地點轉換為 `PlaceCandidate` 結構的字典。
+    # Google 省略的名稱或地址以空字串代替，確保回應符合 `PlaceCandidate` 宣告的字串型別；沒有 place_id 的候選無法分析，直接略過。
+    candidates = [
+        {"name": res.get("name") or "", "address": res.get("formatted_address") or "", "place_id": res["place_id"]}
         for res in data.get("candidates", []) # 從 `data` 字典中獲取 'candidates' 列表，如果不存在則默認為空列表。
+        if res.get("place_id")
     ]
+    # 一次序列化整個列表。輸入是字典而非模型實例，`warnings=False` 關閉 Pydantic 對此的型別提示警告。
+    content = _candidate_adapter.dump_json(candidates, warnings=False)
+    # 只快取 Google 明確回覆成功（包含查無結果）的回應，避免把配額用盡等暫時性錯誤快取 1 小時。
+    if data.get("status") in ("OK", "ZERO_RESULTS"):
+        _search_cache[query] = content
+    return Response(content=content, media_type="application/json")
+
+# /apify-webhook 端點：接收 Apify 任務結束的通知。
+@app.post("/apify-webhook/{run_key}") # 定義一個 POST 請求的 API 端點，Apify 會在任務進入最終狀態時呼叫它。
+async def apify_webhook(run_key: str):
+    """
+    喚醒正在等待 `run_key` 對應 Apify 任務的分析請求。
+    任務由其他 worker 發起時，透過 Redis 將通知轉送給該 worker。
+    通知本身不被信任：被喚醒的請求仍會向 Apify 查詢真正的任務狀態。
+    `run_key`: 啟動任務時產生的 webhook 識別鍵。
+    """
+    run_finished = _apify_run_events.get(run_key) # 查找對應的完成事件。
+    if run_finished is not None: # 任務由本 worker 發起，直接喚醒。
+        run_finished.set() # 設定事件，讓等待中的輪詢立即進行下一次狀態查詢。
+        return {"received": True}
+    if _redis is not None: # 任務可能由其他 worker 發起，發布到對應的頻道。
+        try:
+            subscribers = await _redis.publish(APIFY_WEBHOOK_CHANNEL.format(run_key=run_key), b"1")
+            return {"received": subscribers > 0} # 回報是否有 worker 正在等待此任務。
+        except Exception as e:
+            print(f"WARNING: 轉送 webhook 通知失敗: {e}")
+    return {"received": False} # 沒有對應到等待中的任務。
 
-# /analyze 端點：用於分析指定地點的踩雷分數。
-@app.post("/analyze", response_model=AnalyzeResponse) # 定義一個 POST 請求的 API 端點，路徑為 "/analyze"。
-                                                         # 接收 `AnalyzeRequest` 作為請求體，回傳 `AnalyzeResponse`。
-async def analyze_place(request: AnalyzeRequest):
+# --- 6. 分析流程 ---
+async def _get_cached_analysis(place_id: str) -> AnalyzeResponse | None:
+    """
+    (內部輔助函式) 從 Redis 讀取某地點的分析結果快取。
+    Redis 只是快取：未設定或無法連線時回傳 None，讓呼叫端繼續走資料庫流程。
+    Args:
+        place_id (str): Google 地點的唯一識別符。
+    Returns:
+        AnalyzeResponse | None: 快取的分析結果，沒有快取時為 None。
+    """
+    if _redis is None:
+        return None
+    try:
+        cached = await _redis.get(f"analyze:{place_id}")
+    except Exception as e:
+        print(f"WARNING: 讀取 Redis 快取失敗: {e}")
+        return None
+    if cached is None:
+        return None
+    print(f"INFO: 在 Redis 中找到分析結果快取: {place_id}")
+    return AnalyzeResponse.model_validate_json(cached)
+
+async def _cache_analysis(place_id: str, response: AnalyzeResponse) -> None:
+    """
+    (內部輔助函式) 將分析結果以 orjson 序列化後存入 Redis，ANALYZE_CACHE_TTL 秒後過期。
+    寫入失敗只會記錄警告，不影響回傳結果。
+    Args:
+        place_id (str): Google 地點的唯一識別符。
+        response (AnalyzeResponse): 要快取的分析結果。
     """
-    根據提供的地點 ID 分析其踩雷分數和報告。
+    if _redis is None:
+        return
+    try:
+        await _redis.set(f"analyze:{place_id}", orjson.dumps(response.model_dump(mode="json")), ex=ANALYZE_CACHE_TTL)
+    except Exception as e:
+        print(f"WARNING: 寫入 Redis 快取失敗: {e}")
+
+async def _analyze(place_id: str) -> AnalyzeResponse:
+    """
+    (內部輔助函式) 根據提供的地點 ID 分析其踩雷分數和報告。
     會優先從資料庫快取中查找，若無則啟動 Apify 抓取數據。
-    `request`: 包含 `place_id` 的請求體。
+    Args:
+        place_id (str): Google 地點的唯一識別符。
+    Returns:
+        AnalyzeResponse: 分析結果。
+    Raises:
+        HTTPException: 如果數據抓取、資料庫寫入或特徵工程失敗。
     """
-    place_id = request.place_id # 從請求體中獲取 `place_id`。
-    print(f"INFO: 收到新的分析請求: Place ID = {place_id}") # 打印日誌訊息，指示收到新的分析請求。
-    
-    if places_collection is None or reviews_collection is None: # 檢查資料庫集合是否已成功初始化（即資料庫連線是否成功）。
-        raise HTTPException(status_code=503, detail="資料庫服務不可用。") # 如果資料庫服務不可用，則拋出 503 錯誤。
+    cached = await _get_cached_analysis(place_id) # 先查詢 Redis，命中時不需要讀取資料庫或重新計算。
+    if cached is not None:
+        return cached
 
-    place_data = places_collection.find_one({"_id": place_id}) # 嘗試從 `places_collection` 中查找是否有該 `place_id` 的快取數據。
+    # 同時查詢 `places_collection` 中該 `place_id` 的快取數據，以及 `reviews_collection` 中與其相關的所有評論。
+    # 兩個查詢彼此獨立，並行發出可以讓快取命中時只需等待一次資料庫往返。
+    place_data, reviews_list = await asyncio.gather(
+        places_collection.find_one({"_id": place_id}),
+        reviews_collection.find({"place_id": place_id}, projection=REVIEW_PROJECTION).to_list(length=None)
+    )
     
     if place_data: # 如果在資料庫中找到快取數據。
         print(f"INFO: 在 Cosmos DB 中找到快取: {place_id}") # 打印日誌訊息，指示找到快取。
-        reviews_list = list(reviews_collection.find({"place_id": place_id})) # 從 `reviews_collection` 中查找與該 `place_id` 相關的所有評論。
         place_info = place_data # 使用從資料庫獲取的地點數據作為 `place_info`。
         place_info["reviews"] = reviews_list # 將查找到的評論列表添加到 `place_info` 字典中。
     else: # 如果資料庫中沒有快取數據。
         print(f"INFO: Cosmos DB 中無快取，正在啟動 Apify 即時數據抓取...") # 打印日誌訊息，指示將啟動即時數據抓取。
         try:
-            apify_data = _run_apify_actor_and_get_data(place_id) # 調用內部輔助函數 `_run_apify_actor_and_get_data` 啟動 Apify 任務抓取數據。
-            if not apify_data: raise ValueError("Apify 未回傳任何數據。") # 如果 Apify 未回傳任何數據，則拋出錯誤。
-            place_info = apify_data[0] # Apify 回傳的通常是一個列表，取第一個元素作為主要的地點資訊。
+            dataset_id = await _run_apify_actor(place_id) # 調用內部輔助函數 `_run_apify_actor` 啟動 Apify 任務抓取數據。
+            # Apify 回傳的通常是一個列表，只需要第一個元素作為主要的地點資訊；取得後即停止下載。
+            async with aclosing(_iter_apify_dataset(dataset_id)) as items:
+                place_info = await anext(items, None)
+            if not place_info: raise ValueError("Apify 未回傳任何數據。") # 如果 Apify 未回傳任何數據，則拋出錯誤。
             reviews_list = place_info.get("reviews", []) # 從 Apify 獲取的地點資訊中提取評論列表。
 
             # 將抓取到的地點資訊存入資料庫以供快取。
             place_to_insert = place_info.copy() # 複製 `place_info` 以避免修改原始數據。
             place_to_insert.pop("reviews", None) # 移除 'reviews' 字段，因為評論將被單獨儲存。
             place_to_insert["_id"] = place_id # 將 `_id` 設置為 `place_id`，這是 MongoDB 的主鍵。
-            places_collection.insert_one(place_to_insert) # 將地點資訊插入到 `places_collection` 中。
 
             if reviews_list: # 如果有評論數據。
+                # 在寫入前先計算情感分數與關鍵字計數並存入評論文件，之後的快取命中就不需要再呼叫 Azure 或重新計算關鍵字。
+                # Azure SDK 是同步的，因此放到背景執行緒中執行，避免阻塞事件迴圈。
+                await asyncio.to_thread(engineer.materialize_review_features, reviews_list)
+
+            # 先寫入地點，再寫入評論：同一地點的多個分析任務同時未命中快取時，只有第一個任務能寫入地點（`_id` 重複），
+            # 其餘任務不再寫入評論，避免評論被重複儲存。
+            try:
+                await places_collection.insert_one(place_to_insert) # 將地點資訊插入到 `places_collection` 中。
+                place_stored = True
+            except DuplicateKeyError:
+                print(f"INFO: 地點 {place_id} 已由其他分析任務寫入，略過重複寫入。")
+                place_stored = False
+
+            if place_stored and reviews_list:
                 for review in reviews_list: # 遍歷每一條評論。
                     review["place_id"] = place_id # 為每條評論添加 `place_id` 字段，以便關聯。
-                reviews_collection.insert_many(reviews_list) # 將評論列表批量插入到 `reviews_collection` 中。
+                try:
+                    # 將評論列表批量插入到 `reviews_collection` 中。`ordered=False` 讓伺服器不必依序逐筆寫入，遇到重複的評論也會繼續寫入其餘評論。
+                    await reviews_collection.insert_many(reviews_list, ordered=False)
+                except BulkWriteError as e:
+                    # (place_id, reviewId) 唯一索引拒絕的重複評論可以忽略；其他寫入錯誤仍需拋出。
+                    if e.details.get("writeConcernErrors") or any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
             print("INFO: 新資料已成功存入 Azure Cosmos DB。") # 打印日誌訊息，指示新資料已成功存入資料庫。
         except Exception as e: # 捕獲在 Apify 數據抓取或資料庫寫入過程中可能發生的任何異常。
             raise HTTPException(status_code=500, detail=f"Apify 數據抓取或資料庫寫入失敗: {e}") # 拋出 500 內部伺服器錯誤。
 
     # 調用 FeatureEngineer 的 run 方法，執行特徵工程。
-    # 它會回傳三個值：處理後的 DataFrame、趨勢資訊字典、關鍵片語字典。
-    processed_df, trend_info, key_phrases = engineer.run(place_info)
-    if processed_df is None: # 如果 `FeatureEngineer.run` 回傳 None (表示處理失敗，例如缺少必要數據)。
+    # 它會回傳三個值：逐評論特徵字典、趨勢資訊字典、關鍵片語字典。
+    # 特徵工程是 CPU 密集的同步運算，因此放到背景執行緒中執行，避免阻塞事件迴圈。
+    cached_trend = place_info.get("trend_info") # 地點文件上先前儲存的趨勢資訊（如果有）。
+    features, trend_info, key_phrases = await asyncio.to_thread(engineer.run, place_info)
+    if features is None: # 如果 `FeatureEngineer.run` 回傳 None (表示處理失敗，例如缺少必要數據)。
         raise HTTPException(status_code=500, detail="特徵工程執行失敗。") # 拋出 500 內部伺服器錯誤。
+    if place_info.get("trend_info") is not cached_trend: # 趨勢資訊被重新計算過，將其存回地點文件供下次沿用。
+        await places_collection.update_one({"_id": place_id}, {"$set": {"trend_info": place_info["trend_info"]}})
 
     # 調用 LandmineScorer 的 calculate_score 方法，計算最終踩雷分數和摘要。
     # 它會回傳兩個值：最終分數和摘要文字。
-    score, summary = scorer.calculate_score(processed_df, trend_info)
+    score, summary = scorer.calculate_score(features, trend_info)
     
     risk_level = "低度風險" # 預設風險等級為「低度風險」。
     if score > 70: risk_level = "高度風險" # 如果分數大於 70，則設定為「高度風險」。
@@ -195,8 +468,8 @@ async def analyze_place(request: AnalyzeRequest):
     place_name = place_info.get("title", place_id) # 從 `place_info` 中獲取地點的標題名稱，如果沒有則使用 `place_id`。
     print(f"INFO: 分析完成。地點: {place_name}, 踩雷分數: {score:.2f}") # 打印日誌訊息，顯示分析結果。
     
-    # 構建 `AnalyzeResponse` 對象並回傳。
-    return AnalyzeResponse(
+    # 構建 `AnalyzeResponse` 對象。
+    response = AnalyzeResponse(
         place_name=place_name, # 地點名稱。
         landmine_score=round(score, 2), # 踩雷分數，四捨五入到小數點後兩位。
         risk_level=risk_level, # 風險等級。
@@ -205,8 +478,90 @@ async def analyze_place(request: AnalyzeRequest):
         positive_points=key_phrases.get("positive_points", []), # 正面提及片語列表，如果沒有則為空列表。
         details=trend_info # 詳細數據（趨勢資訊）。
     )
+    await _cache_analysis(place_id, response) # 存入 Redis（會覆蓋重新抓取前的舊結果）。
+    return response
+
+async def _run_analyze_job(job_id: str, place_id: str) -> None:
+    """
+    (內部輔助函式) 在背景執行分析，並將結果或錯誤寫入 `results_collection`。
+    Args:
+        job_id (str): 分析任務的唯一識別碼。
+        place_id (str): Google 地點的唯一識別符。
+    """
+    try:
+        result = await _analyze(place_id) # 執行完整的分析流程（可能需要數分鐘的 Apify 抓取）。
+        update = {"status": "SUCCEEDED", "result": result.model_dump(mode="json")} # `mode="json"` 確保所有數值都能被資料庫編碼。
+    except HTTPException as e: # 分析流程中預期的錯誤（數據抓取失敗、特徵工程失敗等）。
+        update = {"status": "FAILED", "error": e.detail}
+    except Exception as e: # 任何其他未預期的錯誤，也必須記錄下來，否則任務會永遠停在 PENDING。
+        update = {"status": "FAILED", "error": f"分析任務執行失敗: {e}"}
+    # 只更新仍為 PENDING 的任務：已被 GET /analyze/{job_id} 判定逾時（FAILED）的任務不會再被改為其他狀態。
+    result = await results_collection.update_one({"_id": job_id, "status": "PENDING"}, {"$set": update})
+    if result.matched_count == 0:
+        print(f"WARNING: 分析任務 {job_id} 已不是 PENDING（可能已逾時），不寫入結果。")
+    else:
+        print(f"INFO: 分析任務 {job_id} 已結束，狀態: {update['status']}") # 打印日誌訊息，顯示任務的最終狀態。
+
+# --- 7. 分析任務 API ---
+# POST /analyze 端點：建立分析任務並立即回傳任務 ID。
+@app.post("/analyze", status_code=202, response_model=AnalyzeJobAccepted) # 定義一個 POST 請求的 API 端點，路徑為 "/analyze"。
+                                                                           # 接收 `AnalyzeRequest` 作為請求體，以 202 Accepted 回傳 `AnalyzeJobAccepted`。
+async def analyze_place(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+    """
+    建立一個地點分析任務。分析（包含可能長達數分鐘的 Apify 抓取）會在背景執行，
+    客戶端應輪詢回傳的 `status_url` 取得結果。
+    `request`: 包含 `place_id` 的請求體。
+    """
+    place_id = request.place_id # 從請求體中獲取 `place_id`。
+    print(f"INFO: 收到新的分析請求: Place ID = {place_id}") # 打印日誌訊息，指示收到新的分析請求。
+    
+    if places_collection is None or reviews_collection is None or results_collection is None: # 檢查資料庫集合是否已成功初始化（即資料庫連線是否成功）。
+        raise HTTPException(status_code=503, detail="資料庫服務不可用。") # 如果資料庫服務不可用，則拋出 503 錯誤。
+
+    # 同一地點已有尚未逾時的處理中任務時直接沿用，避免重複啟動 Apify 抓取（例如重複點擊，或多位使用者同時查詢同一地點）。
+    pending = await results_collection.find_one(
+        {"place_id": place_id, "status": "PENDING", "created_at": {"$gt": datetime.now(timezone.utc) - ANALYZE_JOB_TIMEOUT}},
+        projection={"_id": 1}
+    )
+    if pending is not None:
+        print(f"INFO: 沿用處理中的分析任務: {pending['_id']}")
+        return AnalyzeJobAccepted(job_id=pending["_id"], status_url=f"/analyze/{pending['_id']}")
+
+    job_id = uuid.uuid4().hex # 產生任務 ID。
+    # 先將任務以 PENDING 狀態寫入資料庫，讓任何 worker 都能回答這個任務的狀態查詢。
+    await results_collection.insert_one({
+        "_id": job_id,
+        "place_id": place_id,
+        "status": "PENDING",
+        "created_at": datetime.now(timezone.utc)
+    })
+    background_tasks.add_task(_run_analyze_job, job_id, place_id) # 在回應送出後，於背景執行分析。
+    return AnalyzeJobAccepted(job_id=job_id, status_url=f"/analyze/{job_id}")
+
+# GET /analyze/{job_id} 端點：查詢分析任務的狀態與結果。
+@app.get("/analyze/{job_id}", response_model=AnalyzeJobStatus) # 定義一個 GET 請求的 API 端點，回傳 `AnalyzeJobStatus`。
+async def get_analyze_job(job_id: str):
+    """
+    查詢分析任務的狀態。任務成功時 `result` 為分析結果，失敗時 `error` 為錯誤訊息。
+    `job_id`: 由 POST /analyze 回傳的任務 ID。
+    """
+    if results_collection is None: # 檢查資料庫集合是否已成功初始化。
+        raise HTTPException(status_code=503, detail="資料庫服務不可用。") # 如果資料庫服務不可用，則拋出 503 錯誤。
+
+    job = await results_collection.find_one({"_id": job_id}) # 從資料庫讀取任務文件。
+    if job is None: # 找不到對應的任務。
+        raise HTTPException(status_code=404, detail="找不到此分析任務。")
+    if job["status"] == "PENDING":
+        created_at = job["created_at"]
+        if created_at.tzinfo is None: # 資料庫讀回的時間不帶時區資訊，但存入時為 UTC。
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - created_at > ANALYZE_JOB_TIMEOUT: # 任務執行過久，已不可能再有結果。
+            job.update(status="FAILED", error="分析任務逾時，請重新分析。")
+            # 只在任務仍為 PENDING 時才更新，避免覆蓋剛好在此時寫入的結果。
+            await results_collection.update_one({"_id": job_id, "status": "PENDING"}, {"$set": {"status": job["status"], "error": job["error"]}})
+    return AnalyzeJobStatus(job_id=job_id, status=job["status"], result=job.get("result"), error=job.get("error"))
 
-# --- 6. 掛載前端靜態檔案 (放在最後，最穩定的方式) ---
+# --- 8. 掛載前端靜態檔案 (放在最後，最穩定的方式) ---
 # 構建靜態檔案目錄的絕對路徑。`os.path.dirname(__file__)` 獲取當前檔案的目錄，`'..'` 向上退一層（到專案根目錄），然後進入 'static' 資料夾。
 static_dir = os.path.join(os.path.dirname(__file__), '..', 'static')
 # 將根路徑 "/" 掛載到靜態檔案服務。
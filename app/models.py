@@ -1,10 +1,18 @@
-import pandas as pd # 導入 pandas 庫 , 用於數據處理和表格操作，特別是 DataFrame 。
-import numpy as np # 導入 numpy 庫, 用於數值計算 (此處雖未直接使用，但常與 pandas 搭配)。
+import numpy as np # 導入 numpy 庫, 用於數值計算，例如以向量內積一次完成關鍵字風險的加權加總。
+
+# 各特徵對應的風險原因說明，順序與 `calculate_score` 中的分數向量 [F1, F2, F3, F5] 一致 
+_RISK_LABELS = (
+    "大量的低星負評",
+    "評論中提及的負面關鍵字 (如食安、服務)",
+    "近期的評價有下降趨勢",
+    "評論內容的整體負面情緒"
+)
 
 class LandmineScorer:
     """
     踩雷分數計算器 (AI 增強版) 。
     接收包含多維度AI特徵的數據，並根據更新後的加權公式計算最終踩雷分數和動態摘要 。
+    評論數量最多只有數十筆，因此直接以 NumPy 陣列計算，不經過 pandas 。
     """
     def __init__(self, weights: dict = None):
         """
@@ -22,6 +30,12 @@ class LandmineScorer:
             }
         else: # 如果提供了自定義權重 
             self.weights = weights # 使用提供的權重 
+        # 各特徵分數的權重向量，順序與 _RISK_LABELS 一致 [F1, F2, F3, F5] 
+        self._weights_arr = np.array([
+            self.weights['f1_neg_reviews'], self.weights['f2_keywords'], self.weights['f3_trend'], self.weights['f5_sentiment']
+        ])
+        # F2 三層級關鍵字的懲罰分數向量，依序為 [高風險, 中風險, 低風險] 
+        self._f2_weights = np.array([15, 5, 1], dtype=np.float32) 
         print("INFO: LandmineScorer (AI 增強版) 已準備就緒。") # 初始化成功時印出資訊 
 
     def _calculate_f1_score(self, reviews_distribution: dict, total_reviews: int) -> float:
@@ -38,30 +52,19 @@ class LandmineScorer:
         score = (weighted_negative_count / total_reviews) * 200 # 計算分數，並映射到 0-200 範圍 
         return min(score, 100.0) # 確保分數不超過 100 
 
-    def _calculate_f2_score(self, df: pd.DataFrame) -> float:
+    def _calculate_f2_score(self, features: dict) -> float:
         """ 
         私有方法：計算 F2 - 關鍵字風險分數 (0-100) 。
         處理三層級的風險關鍵字 。
         """
-        if df.empty: # 如果 DataFrame 為空，分數為 0 
-            return 0.0 # 回傳 0.0 
-            
-        total_reviews = len(df) # 獲取評論總數 
+        total_reviews = features["high_risk"].size # 獲取評論總數 
         if total_reviews == 0: # 如果評論總數為 0，分數為 0 
             return 0.0 # 回傳 0.0 
         
-        high_risk_penalty = 15 # 高風險關鍵字的懲罰分數 
-        medium_risk_penalty = 5 # 中風險關鍵字的懲罰分數 
-        low_risk_penalty = 1 # 低風險關鍵字的懲罰分數 
-        
-        total_high_risk = df['high_risk_keyword_count'].sum() # 計算高風險關鍵字總數 
-        total_medium_risk = df['medium_risk_keyword_count'].sum() # 計算中風險關鍵字總數 
-        total_low_risk = df['low_risk_keyword_count'].sum() # 計算低風險關鍵字總數 
-        
-        # 計算綜合風險分數：各級別關鍵字總數乘以各自的懲罰分數後加總 
-        risk_sum = (total_high_risk * high_risk_penalty) + \
-                   (total_medium_risk * medium_risk_penalty) + \
-                   (total_low_risk * low_risk_penalty)
+        # 各級別關鍵字總數，依序為 [高風險, 中風險, 低風險] 
+        totals = np.array([features["high_risk"].sum(), features["medium_risk"].sum(), features["low_risk"].sum()]) 
+        # 計算綜合風險分數：各級別關鍵字總數與懲罰分數向量 [15, 5, 1] 做內積 
+        risk_sum = float(totals @ self._f2_weights) 
         
         score = (risk_sum / total_reviews) * 100 # 將綜合風險分數歸一化到 0-100 範圍 
         return min(score, 100.0) # 確保分數不超過 100 
@@ -72,24 +75,25 @@ class LandmineScorer:
         score = max(0, trend_score) * 50 
         return min(score, 100.0) # 確保分數不超過 100 
 
-    def _calculate_f5_score(self, df: pd.DataFrame) -> float:
+    def _calculate_f5_score(self, features: dict) -> float:
         """ 
         新增的私有方法：計算 F5 - 情感分析分數 (0-100) 。
         """
-        if df.empty or 'sentiment_score' not in df.columns: # 如果 DataFrame 為空或沒有情感分數欄位 
+        if features["sentiment"].size == 0: # 如果沒有任何情感分數 
             return 0.0 # 回傳 0.0 
         
-        avg_sentiment = df['sentiment_score'].mean() # 計算評論的平均情感分數 (範圍 -1 到 1) 
+        avg_sentiment = float(features["sentiment"].mean()) # 計算評論的平均情感分數 (範圍 -1 到 1) 
         # 將情感分數轉換為踩雷分數：越負面 (接近 -1)，分數越高 (接近 100) 
         score = (1 - avg_sentiment) * 50 
         return max(0.0, min(score, 100.0)) # 確保分數在 0 到 100 之間 
 
-    def calculate_score(self, processed_df: pd.DataFrame, trend_info: dict) -> tuple[float, str]:
+    def calculate_score(self, features: dict, trend_info: dict) -> tuple[float, str]:
         """
         公開方法：計算最終的 Landmine Score，並產生動態摘要 。
         回傳一個包含 (分數, 摘要文字) 的元組 。
         Args:
-            processed_df (pd.DataFrame): 經過特徵工程處理後的評論數據 DataFrame。
+            features (dict): 經過特徵工程處理後的逐評論特徵，每個值都是長度等於評論數的 NumPy 陣列：
+                "high_risk" / "medium_risk" / "low_risk" 為各級關鍵字數量，"sentiment" 為情感分數。
             trend_info (dict): 包含歷史和近期平均評分、評論總數等趨勢相關的字典。
         Returns:
             tuple[float, str]: 一個包含 (最終踩雷分數, 動態摘要文字) 的元組。
@@ -98,33 +102,24 @@ class LandmineScorer:
             trend_info.get('reviews_distribution', {}), # 獲取評論分佈 
             trend_info.get('total_reviews', 0) # 獲取評論總數 
         )
-        f2_score = self._calculate_f2_score(processed_df) # 計算 F2 分數 
+        f2_score = self._calculate_f2_score(features) # 計算 F2 分數 
         f3_score = self._calculate_f3_score(trend_info.get('trend_score', 0)) # 計算 F3 分數 
-        f5_score = self._calculate_f5_score(processed_df) # 計算 F5 分數 
+        f5_score = self._calculate_f5_score(features) # 計算 F5 分數 
         
         print(f"INFO: AI 增強版特徵分數 -> F1(負評): {f1_score:.2f}, F2(關鍵字): {f2_score:.2f}, F3(趨勢): {f3_score:.2f}, F5(情感): {f5_score:.2f}") # 印出各特徵分數 
 
         # --- 動態摘要生成 ---
-        scores_map = { # 建立風險原因與其分數的映射 
-            "大量的低星負評": f1_score,
-            "評論中提及的負面關鍵字 (如食安、服務)": f2_score,
-            "近期的評價有下降趨勢": f3_score,
-            "評論內容的整體負面情緒": f5_score
-        }
-        # 找到分數最高的風險來源 
-        if max(scores_map.values()) > 20: # 只有在某項風險足夠顯著 (分數大於 20) 時才產生特定摘要 
-            dominant_risk_reason = max(scores_map, key=scores_map.get) # 找出分數最高的風險原因 
+        scores_arr = np.array([f1_score, f2_score, f3_score, f5_score]) # 建立與 _RISK_LABELS 順序一致的分數向量 
+        # 找到分數最高的風險來源。`argmax` 在分數相同時回傳第一個，與原本的 `max(..., key=...)` 行為一致 
+        dominant_idx = int(scores_arr.argmax()) 
+        dominant_risk_reason = _RISK_LABELS[dominant_idx] # 找出分數最高的風險原因 
+        if scores_arr[dominant_idx] > 20: # 只有在某項風險足夠顯著 (分數大於 20) 時才產生特定摘要 
             summary = f"注意，主要風險可能來自於「{dominant_risk_reason}」。" # 生成特定摘要 
         else:
             summary = "數據顯示此地點的負面指標較少，整體風險低。" # 如果所有風險分數都較低，則為低風險摘要 
             
         # --- 最終分數計算 ---
-        final_score = ( # 根據各特徵分數及其權重計算最終分數 
-            f1_score * self.weights['f1_neg_reviews'] +
-            f2_score * self.weights['f2_keywords'] +
-            f3_score * self.weights['f3_trend'] +
-            f5_score * self.weights['f5_sentiment']
-        )
+        final_score = float(scores_arr @ self._weights_arr) # 根據各特徵分數及其權重計算最終分數 (加權總和即分數向量與權重向量的內積) 
         
         final_score = max(0.0, min(final_score, 100.0)) # 確保最終分數在 0.0 到 100.0 之間 
         
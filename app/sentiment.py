@@ -1,13 +1,17 @@
-import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數。
+import hashlib # 導入 hashlib，用 SHA1 雜湊作為 SQLite 快取的鍵，避免在資料表中儲存完整的評論文本。
+import os # 導入 os 模組，用於判斷目前的程序 ID（SQLite 連線不能跨 fork 共用）。
+import sqlite3 # 導入 sqlite3，用於跨程序與重啟保存情感分數。
+import threading # 導入 threading，用於保護多個執行緒共用的快取。
+from concurrent.futures import ThreadPoolExecutor # 導入執行緒池，用於並行送出多個批次請求（Azure SDK 客戶端是執行緒安全的）。
+from cachetools import LRUCache # 導入 LRUCache，一個有容量上限、淘汰最久未使用項目的字典，用於記憶體中的情感分數快取。
 from azure.core.credentials import AzureKeyCredential # 從 Azure SDK 的 `azure.core.credentials` 導入 `AzureKeyCredential` 類。這個類用於使用 API 金鑰進行 Azure 服務的身份驗證。
 from azure.ai.textanalytics import TextAnalyticsClient # 從 Azure SDK 的 `azure.ai.textanalytics` 導入 `TextAnalyticsClient` 類。這個類是與 Azure AI Language 服務進行交互的核心客戶端。
-from dotenv import load_dotenv # 從 `dotenv` 庫導入 `load_dotenv` 函數，用於從 `.env` 檔案載入環境變數。
+from app.config import get_settings # 從 `app/config.py` 導入 `get_settings`，集中讀取（並快取）所有環境變數設定。
 
-load_dotenv() # 調用此函數，會自動讀取專案根目錄下的 `.env` 檔案，並將其中的鍵值對載入到程式的環境變數中。
-
-# 從環境變數讀取 Azure 憑證
-AZURE_KEY = os.getenv("AZURE_LANGUAGE_KEY") # 從環境變數中獲取名為 "AZURE_LANGUAGE_KEY" 的值，這是 Azure AI Language 服務的訂閱金鑰。
-AZURE_ENDPOINT = os.getenv("AZURE_LANGUAGE_ENDPOINT") # 從環境變數中獲取名為 "AZURE_LANGUAGE_ENDPOINT" 的值，這是 Azure AI Language 服務的端點 URL。
+# 從集中設定讀取 Azure 憑證
+AZURE_KEY = get_settings().AZURE_KEY # Azure AI Language 服務的訂閱金鑰（環境變數 AZURE_LANGUAGE_KEY）。
+AZURE_ENDPOINT = get_settings().AZURE_ENDPOINT # Azure AI Language 服務的端點 URL（環境變數 AZURE_LANGUAGE_ENDPOINT）。
+SENTIMENT_CACHE_PATH = get_settings().SENTIMENT_CACHE_PATH # SQLite 快取檔案路徑（環境變數 SENTIMENT_CACHE_PATH），未設定時不使用。
 
 # 初始化文字分析客戶端
 text_analytics_client = None # 預設文字分析客戶端變數為 None。
@@ -18,41 +22,175 @@ if AZURE_KEY and AZURE_ENDPOINT: # 檢查是否成功獲取了 Azure 金鑰和
 else: # 如果 Azure 金鑰或端點有任何一個缺失。
     print("WARNING: 未找到 Azure AI Language 的憑證，情感分析功能將被禁用。") # 打印警告訊息，告知情感分析功能將不可用。
 
+MAX_DOCUMENTS_PER_REQUEST = 10 # Azure `analyze_sentiment` 每次請求最多接受的文件數量。
+SENTIMENT_CACHE_SIZE = 50_000 # 記憶體快取最多保留的文本數量。
+
+# 相同的評論文本（複製貼上、「很好吃」這類短評）只需要分析一次。
+# 記憶體快取以文本為鍵；SQLite 快取以文本的 SHA1 雜湊為鍵，在程序重啟後仍可沿用。
+_memory_cache: LRUCache = LRUCache(maxsize=SENTIMENT_CACHE_SIZE) # 文本 -> 情感分數。
+_cache_lock = threading.Lock() # 情感分析會在多個背景執行緒中執行，快取的讀寫都需要加鎖。
+_disk_cache: sqlite3.Connection | None = None # SQLite 連線，在第一次使用時建立。
+_disk_cache_pid: int | None = None # 建立 SQLite 連線的程序 ID；fork 出的 worker 必須建立自己的連線。
+
+MAX_PARALLEL_REQUESTS = 8 # 同時送往 Azure 的批次請求數量上限。請求受網路延遲限制而非 CPU，8 個並行請求即可涵蓋 80 則評論的一般情況。
+
+
+def _to_score(result) -> float:
+    """
+    將 Azure 回傳的單一文件分析結果，轉換為我們自定義的 -1 到 1 區間的情感分數。
+    Args:
+        result: `analyze_sentiment` 回傳列表中的單一元素（分析結果或錯誤物件）。
+    Returns:
+        float: 情感分數。分析出錯或判斷為中性時回傳 0.0。
+    """
+    # 如果分析出錯（例如文本格式問題，或服務內部錯誤），則回傳中性。
+    if result.is_error: # 檢查回應對象的 `is_error` 屬性，判斷分析是否出錯。
+        return 0.0 # 如果出錯，回傳中性分數 0.0。
+
+    # Azure 的情感結果在 `result.sentiment` 中（"positive", "neutral", "negative"），
+    # 信心分數在 `result.confidence_scores` 中（包含 positive, neutral, negative 的分數，範圍 0-1）。
+    if result.sentiment == "positive": # 如果 Azure 判斷的情感是 "positive"。
+        return result.confidence_scores.positive # 回傳其正向信心分數（範圍 0 到 1）。
+    elif result.sentiment == "negative": # 如果 Azure 判斷的情感是 "negative"。
+        return -result.confidence_scores.negative # 回傳其負向信心分數，並取負值，使其在 -1 到 0 之間。
+    else: # 如果 Azure 判斷的情感是 "neutral"（中性）。
+        return 0.0 # 回傳中性分數 0.0。
+
 
 def get_sentiment_score(text: str) -> float:
     """
     使用 Azure AI Language 服務，分析一段文字並回傳情感分數。
     分數範圍：正向為 (0, 1]，中性為 0，負向為 [-1, 0)。
+    與批次版本共用快取，相同的文本不會重複呼叫 Azure。
     Args:
         text (str): 要進行情感分析的文本字符串。
     Returns:
         float: 情感分數。
     """
-    if not text_analytics_client: # 檢查 `text_analytics_client` 是否已成功初始化。如果為 None，表示服務未配置。
-        return 0.0 # 如果服務未初始化，則直接回傳 0.0，表示中性分數，不執行實際的 API 呼叫。
+    return get_sentiment_scores([text])[0]
 
+
+def _get_disk_cache() -> sqlite3.Connection | None:
+    """
+    取得目前程序的 SQLite 快取連線，必要時建立連線與資料表。呼叫端必須持有 `_cache_lock`。
+    Returns:
+        sqlite3.Connection | None: SQLite 連線。未設定 SENTIMENT_CACHE_PATH 或無法開啟時回傳 None。
+    """
+    global _disk_cache, _disk_cache_pid
+    if not SENTIMENT_CACHE_PATH:
+        return None
+    if _disk_cache_pid != os.getpid(): # 第一次使用，或是在 fork 出的 worker 中：建立這個程序自己的連線。
+        try:
+            # 連線由多個執行緒共用（已由 `_cache_lock` 保護），因此關閉同執行緒檢查。
+            _disk_cache = sqlite3.connect(SENTIMENT_CACHE_PATH, check_same_thread=False)
+            _disk_cache.execute("CREATE TABLE IF NOT EXISTS sentiment_scores (hash BLOB PRIMARY KEY, score REAL NOT NULL)")
+        except sqlite3.Error as e: # 快取無法使用時只記錄警告，情感分析仍可正常進行。
+            print(f"WARNING: 無法開啟情感分數快取 {SENTIMENT_CACHE_PATH}: {e}")
+            _disk_cache = None
+        _disk_cache_pid = os.getpid()
+    return _disk_cache
+
+
+def _text_key(text: str) -> bytes:
+    """ 回傳文本的 SHA1 雜湊，作為 SQLite 快取的鍵。 """
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def _get_cached_scores(texts: list[str]) -> dict[str, float]:
+    """
+    從記憶體快取與 SQLite 快取中查詢情感分數。SQLite 中找到的分數也會放入記憶體快取。
+    Args:
+        texts (list[str]): 要查詢的文本列表（不重複）。
+    Returns:
+        dict[str, float]: 找到快取的文本 -> 情感分數。
+    """
+    found = {}
+    with _cache_lock:
+        for text in texts:
+            score = _memory_cache.get(text)
+            if score is not None:
+                found[text] = score
+        missing = {_text_key(text): text for text in texts if text not in found}
+        disk_cache = _get_disk_cache()
+        if missing and disk_cache is not None:
+            keys = list(missing)
+            for i in range(0, len(keys), 500): # 分批查詢，避免超過 SQLite 的參數數量上限。
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, score in disk_cache.execute(f"SELECT hash, score FROM sentiment_scores WHERE hash IN ({placeholders})", chunk):
+                    text = missing[key]
+                    found[text] = _memory_cache[text] = score
+    return found
+
+
+def _store_scores(scores: dict[str, float]) -> None:
+    """
+    將新分析的情感分數寫入記憶體快取與 SQLite 快取。
+    Args:
+        scores (dict[str, float]): 文本 -> 情感分數。
+    """
+    with _cache_lock:
+        _memory_cache.update(scores)
+        disk_cache = _get_disk_cache()
+        if disk_cache is not None:
+            try:
+                with disk_cache: # 以交易一次寫入所有分數。
+                    disk_cache.executemany(
+                        "INSERT OR REPLACE INTO sentiment_scores (hash, score) VALUES (?, ?)",
+                        [(_text_key(text), score) for text, score in scores.items()]
+                    )
+            except sqlite3.Error as e: # 寫入快取失敗不影響分析結果。
+                print(f"WARNING: 寫入情感分數快取失敗: {e}")
+
+
+def _score_batch(texts: list[str]) -> list[float | None]:
+    """
+    以單一 Azure 請求分析一批（最多 MAX_DOCUMENTS_PER_REQUEST 個）文本。
+    Args:
+        texts (list[str]): 要進行情感分析的文本列表。
+    Returns:
+        list[float | None]: 與輸入順序一致的情感分數列表。分析失敗的文件為 None（呼叫失敗時整批皆為 None），
+        讓呼叫端以中性分數代替，但不將其寫入快取。
+    """
     try:
-        # Azure API 的情感分析方法需要傳入一個文件列表，即使只有一個文本也必須放入列表中。
-        documents = [text] # 將輸入的單個文本放入列表中。
-        # 調用 `text_analytics_client` 的 `analyze_sentiment` 方法來執行情感分析。
-        # `language="zh-Hant"` 指定了分析的語言為繁體中文。
-        # `[0]` 表示從回傳結果列表中取出第一個（也是唯一一個）文檔的分析結果。
-        response = text_analytics_client.analyze_sentiment(documents=documents, language="zh-Hant")[0]
-
-        # 如果分析出錯（例如文本格式問題，或服務內部錯誤），則回傳中性。
-        if response.is_error: # 檢查回應對象的 `is_error` 屬性，判斷分析是否出錯。
-            return 0.0 # 如果出錯，回傳中性分數 0.0。
-
-        # 將 Azure 回傳的 正/中/負面 情感判斷及其信心分數，轉換為我們自定義的 -1 到 1 區間。
-        # Azure 的情感結果在 `response.sentiment` 中（"positive", "neutral", "negative"），
-        # 信心分數在 `response.confidence_scores` 中（包含 positive, neutral, negative 的分數，範圍 0-1）。
-        if response.sentiment == "positive": # 如果 Azure 判斷的情感是 "positive"。
-            return response.confidence_scores.positive # 回傳其正向信心分數（範圍 0 到 1）。
-        elif response.sentiment == "negative": # 如果 Azure 判斷的情感是 "negative"。
-            return -response.confidence_scores.negative # 回傳其負向信心分數，並取負值，使其在 -1 到 0 之間。
-        else: # 如果 Azure 判斷的情感是 "neutral"（中性）。
-            return 0.0 # 回傳中性分數 0.0。
-
-    except Exception as e: # 捕獲在呼叫 Azure API 過程中可能發生的任何異常（例如網路連接問題、API 限流、憑證無效等）。
+        results = text_analytics_client.analyze_sentiment(documents=texts, language="zh-Hant") # 一次請求分析整批文本。
+        # Azure 依輸入順序回傳結果，逐一轉換為情感分數。
+        return [None if result.is_error else _to_score(result) for result in results]
+    except Exception as e: # 捕獲網路連接問題、API 限流、憑證無效等異常。
         print(f"ERROR: 呼叫 Azure 情感分析 API 失敗: {e}") # 打印錯誤訊息，包含具體的異常內容。
-        return 0.0 # 發生錯誤時，回傳中性分數 0.0，避免程式崩潰。
\ No newline at end of file
+        return [None] * len(texts) # 發生錯誤時整批視為失敗，由呼叫端回傳中性分數 0.0，避免程式崩潰。
+
+
+def get_sentiment_scores(texts: list[str], default: float | None = 0.0) -> list[float | None]:
+    """
+    批次版本的 `get_sentiment_score`：每 MAX_DOCUMENTS_PER_REQUEST 個文本只發出一次 Azure 請求，
+    並以執行緒池同時送出多個批次。Azure 依文件數計費，因此費用與逐筆呼叫相同，但網路往返次數大幅減少。
+    重複的文本只會送出一次，且已分析過（在記憶體或 SQLite 快取中）的文本不會再送往 Azure。
+    Args:
+        texts (list[str]): 要進行情感分析的文本列表。
+        default (float | None): 未能取得分數的文本（服務未設定、請求失敗或文件分析出錯）所使用的值。
+            預設為中性分數 0.0；需要分辨失敗的呼叫端（例如要將分數存入資料庫時）可傳入 None。
+    Returns:
+        list[float | None]: 與輸入順序一致的情感分數列表。
+    """
+    if not text_analytics_client: # 如果服務未初始化，則全部回傳 `default`，不執行實際的 API 呼叫。
+        return [default] * len(texts)
+
+    unique_texts = list(dict.fromkeys(texts)) # 去除重複的文本，並保留第一次出現的順序。
+    scores = _get_cached_scores(unique_texts) # 先從快取取得已分析過的分數。
+    missing = [text for text in unique_texts if text not in scores] # 需要送往 Azure 分析的文本。
+
+    if missing:
+        # 將文本切分為每批最多 MAX_DOCUMENTS_PER_REQUEST 個的批次。
+        batches = [missing[i:i + MAX_DOCUMENTS_PER_REQUEST] for i in range(0, len(missing), MAX_DOCUMENTS_PER_REQUEST)]
+        if len(batches) == 1: # 只有一個批次時不需要建立執行緒池。
+            results = _score_batch(batches[0])
+        else:
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS) as executor: # 建立執行緒池並行送出批次請求。
+                # `executor.map` 會依照輸入順序回傳結果，因此攤平後與 `missing` 的順序一致。
+                results = [score for batch_scores in executor.map(_score_batch, batches) for score in batch_scores]
+        fresh = {text: score for text, score in zip(missing, results) if score is not None} # 只快取成功分析的結果。
+        _store_scores(fresh)
+        scores.update(fresh)
+
+    return [scores.get(text, default) for text in texts] # 依輸入順序回傳；分析失敗的文本為 `default`。
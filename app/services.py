@@ -1,23 +1,75 @@
 import pandas as pd # 導入 pandas 庫，用於數據處理和表格操作，特別是 DataFrame 
+import numpy as np # 導入 numpy 庫，用於輸出給計分器的數值陣列 
 import json # 導入 json 模組，用於處理 JSON (JavaScript Object Notation) 格式的數據，包括編碼和解碼 
 import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數和處理文件路徑 
 import re # 導入 re 模組，用於處理正規表達式，例如在文本中查找模式或拆分字符串 
-import jieba # 導入 jieba 庫，這是一個流行的中文斷詞工具，用於將中文文本切分成詞語 
+import time # 導入 time 模組，用於記錄趨勢資訊的計算時間 
+from datetime import datetime, timedelta, timezone # 導入日期時間相關模組，用於計算 F3 近期趨勢的時間範圍 
+from itertools import islice # 導入 islice，用於在取得足夠的不重複片語後停止讀取 
+import pyarrow as pa # 導入 pyarrow，以明確的欄位型別將評論一次轉換為欄式的 Arrow Table 
+import pyarrow.compute as pc # 導入 pyarrow 的向量化運算函數，用於清洗評論數據 
+import pyarrow.parquet as pq # 導入 pyarrow 的 Parquet 模組，用於讀取評論 Parquet 檔案 
+import ahocorasick # 導入 pyahocorasick，以 Aho-Corasick 自動機一次掃描文本即可找出所有關鍵字 
 
 # 匯入我們新的情感分析模組
-from app.sentiment import get_sentiment_score # 從 `app.sentiment` 模組導入 `get_sentiment_score` 函數，用於執行情感分析 
+from app.sentiment import get_sentiment_scores # 從 `app.sentiment` 模組導入 `get_sentiment_scores` 函數，用於批次執行情感分析 
 
 # 建立相對於本檔案位置的絕對路徑，確保在任何環境下都能正確讀取檔案
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) # 獲取當前腳本文件（services.py）的絕對路徑 
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR) # 獲取專案的根目錄路徑，通常是當前腳本文件所在目錄的父目錄 
 
+# 預先計算並儲存的特徵版本。關鍵字詞庫或計算方式改變時請遞增，舊版本的快取特徵就會被視為過期並重新計算 
+# 版本 2：關鍵字計數改以 Aho-Corasick 子字串比對取代 Jieba 斷詞後的詞語比對 
+# 版本 3：改為只計算最長且不重疊的比對，並移除容易誤判的單字關鍵字（臭、貴、生的、盤子） 
+FEATURES_VERSION = 3 
+# 三層級關鍵字計數欄位的名稱 
+KEYWORD_COUNT_FIELDS = ['high_risk_keyword_count', 'medium_risk_keyword_count', 'low_risk_keyword_count'] 
+# 在評論寫入資料庫前預先計算、並隨評論一起儲存的特徵欄位。從快取讀回時若已存在，`run()` 就不會重新計算 
+MATERIALIZED_REVIEW_FIELDS = ['sentiment_score'] + KEYWORD_COUNT_FIELDS + ['features_version'] 
+# 評論的原始欄位名稱與內部使用名稱的映射關係，這三個欄位是特徵工程的必要欄位 
+REQUIRED_REVIEW_COLUMNS = {'stars': 'rating', 'text': 'text', 'publishedAtDate': 'datetime'} 
+# 評論轉換為 Arrow Table 時使用的結構：必要欄位加上預先計算的特徵欄位。評論中的其他欄位會被忽略，缺少的欄位為 null。
+# 星級先以浮點數讀入（可同時接受整數與浮點數），清洗後再轉為 int8；日期先以字串讀入，清洗後再轉為 UTC 時間戳記 
+REVIEW_SCHEMA = pa.schema([
+    ('stars', pa.float64()), 
+    ('text', pa.large_string()), 
+    ('publishedAtDate', pa.string()), 
+    ('sentiment_score', pa.float64()), 
+    ('high_risk_keyword_count', pa.int64()), 
+    ('medium_risk_keyword_count', pa.int64()), 
+    ('low_risk_keyword_count', pa.int64()), 
+    ('features_version', pa.int64()), 
+]) 
+# 儲存在地點文件上的趨勢資訊的有效時間（秒）。趨勢以「近 90 天」計算，因此不能永久沿用 
+TREND_CACHE_SECONDS = 24 * 60 * 60 
+# F3 近期趨勢所使用的時間範圍 
+_NINETY_DAYS = timedelta(days=90) 
+
+
+def _first_unique(items: list, limit: int) -> list:
+    """
+    依原本的順序回傳前 `limit` 個不重複的項目，找到足夠的項目後即停止，不會走訪整個列表。
+    Args:
+        items (list): 可能包含重複項目的列表。
+        limit (int): 最多回傳的項目數量。
+    Returns:
+        list: 不重複的項目列表。
+    """
+    seen = set() 
+    # `seen.add` 回傳 None，因此只有第一次出現的項目會通過篩選；islice 取滿 `limit` 個後生成器即不再前進 
+    return list(islice((item for item in items if not (item in seen or seen.add(item))), limit)) 
+
+
 class FeatureEngineer:
     """
     一個負責處理原始評論數據並從中提取特徵的類別。(AI 增強版) 
-    - 使用 Jieba 進行精準斷詞。 
+    - 使用 Aho-Corasick 自動機計算風險關鍵字。 
     - 呼叫外部 AI 服務進行情感分析。 
     - 摘錄評論中的關鍵片語。 
     """
+    # 用於將評論拆分為句子的正規表達式，在類別定義時編譯一次。分句符包括逗號、句號、問號、感嘆號和換行符 
+    _SENT_SPLIT = re.compile(r'[，。！？,!?\n]') 
+
     def __init__(self, keywords_path=os.path.join(PROJECT_ROOT, "data", "keywords.json")):
         """
         初始化 FeatureEngineer。 
@@ -41,81 +93,165 @@ class FeatureEngineer:
             # 如果找不到關鍵字檔案，打印錯誤訊息，並將所有關鍵字集合初始化為空 Set，確保程式不會因為缺失文件而崩潰 
             print(f"錯誤：找不到關鍵字檔案於 {keywords_path}。請確認檔案位置。") 
             self.high_risk_set, self.medium_risk_set, self.low_risk_set, self.positive_set, self.all_negative_set = [set() for _ in range(5)] 
+        # 將三層級的負面關鍵字預先編譯成單一自動機，之後每則評論只需掃描一次 
+        self._keyword_automaton = self._build_keyword_automaton() 
+        # 正面關鍵字只用於摘錄片語，同樣預先編譯成自動機（負面片語直接沿用上面的自動機） 
+        self._positive_automaton = self._build_phrase_automaton(self.positive_set) 
+
+    def _build_keyword_automaton(self):
+        """ 私有方法：將三層級的負面關鍵字編譯成一個 Aho-Corasick 自動機。 
+            每個關鍵字的值為 (關鍵字的整數 ID, 所屬層級索引的 tuple)，層級索引對應 KEYWORD_COUNT_FIELDS 的順序。 
+            沒有任何關鍵字時回傳 None。 
+        """
+        levels = {} # 關鍵字 -> 所屬層級索引列表（同一個關鍵字可能出現在多個層級） 
+        for level, keyword_set in enumerate((self.high_risk_set, self.medium_risk_set, self.low_risk_set)): 
+            for keyword in keyword_set: 
+                levels.setdefault(keyword, []).append(level) 
+        if not levels: # 空的自動機無法進行比對 
+            return None 
+        automaton = ahocorasick.Automaton() 
+        for keyword_id, (keyword, keyword_levels) in enumerate(levels.items()): 
+            automaton.add_word(keyword, (keyword_id, tuple(keyword_levels))) 
+        automaton.make_automaton() # 建立失敗連結，完成自動機 
+        return automaton 
+
+    @staticmethod
+    def _build_phrase_automaton(keyword_set: set):
+        """ 私有方法：將一組關鍵字編譯成 Aho-Corasick 自動機，只用於判斷句子是否包含任一關鍵字。 
+            沒有任何關鍵字時回傳 None。 
+        """
+        if not keyword_set: # 空的自動機無法進行比對 
+            return None 
+        automaton = ahocorasick.Automaton() 
+        for keyword in keyword_set: 
+            automaton.add_word(keyword, keyword) 
+        automaton.make_automaton() 
+        return automaton 
+
+    @staticmethod
+    def _contains_keyword(sentence: str, automaton) -> bool:
+        """ 私有方法：判斷句子是否包含自動機中的任一關鍵字。 
+            只需掃描句子一次並在第一個命中時停止；沒有任何關鍵字（自動機為 None）時回傳 False。 
+        """
+        return automaton is not None and next(automaton.iter(sentence), None) is not None 
 
     def _calculate_f1_depth(self, df: pd.DataFrame) -> pd.DataFrame:
         """ 私有方法：計算 F1 - 負評深度。 
             這個方法會為 DataFrame 添加兩個新的布林值欄位。 
         """
         # 根據 'rating' (星級) 欄位判斷評論是否為負面（星級 <= 2），並創建一個新的布林值欄位 'is_negative' 
-        df['is_negative'] = df['rating'] <= 2 
+        # 直接在底層的 NumPy 陣列上比較，避免 pandas Series 運算的額外開銷 
+        df['is_negative'] = df['rating'].to_numpy() <= 2 
         # 根據 'text' (評論文本) 的長度判斷是否為長評論（長度 > 100），並創建一個新的布林值欄位 'is_long_review' 
-        df['is_long_review'] = df['text'].str.len() > 100 
+        # 以 `np.fromiter` 直接產生整數長度陣列，取代逐列處理 Python 物件的 `.str.len()` 
+        lengths = np.fromiter((len(text) for text in df['text'].to_numpy()), dtype=np.int32, count=len(df)) 
+        df['is_long_review'] = lengths > 100 
         return df # 回傳添加了新欄位的 DataFrame 
 
-    def _calculate_f2_keywords_jieba(self, text: str) -> dict:
-        """ 私有方法：使用 Jieba 斷詞來精準計算文本中不同風險等級關鍵字的數量。 
+    def _calculate_f2_keywords(self, text: str) -> tuple[int, int, int]:
+        """ 私有方法：計算文本中不同風險等級關鍵字的數量。 
+            以 Aho-Corasick 自動機對文本做一次掃描，只取最長且彼此不重疊的比對（`iter_long`）， 
+            讓「臭味」、「廁所很髒」這類包含較短關鍵字的詞只計算一次，與斷詞後的詞語比對一致。 
+            與原本的集合交集相同，每個關鍵字在同一則評論中只計算一次。 
+            回傳 (高風險, 中風險, 低風險) 關鍵字數量，順序與 KEYWORD_COUNT_FIELDS 一致。 
         """
-        # 使用 jieba.cut 進行斷詞，`cut_all=False` 表示使用精確模式，這更適合關鍵字匹配 
-        seg_list = jieba.cut(text, cut_all=False) 
-        # 將斷詞結果轉換為集合 (Set)，以便快速查找關鍵字並自動處理重複詞語 
-        word_set = set(seg_list) 
-        
-        return {
-            # 計算文本中高風險關鍵字的數量。通過集合交集操作 `intersection()` 找出共同的詞語，然後計算數量 
-            'high_risk_keyword_count': len(self.high_risk_set.intersection(word_set)), 
-            # 計算文本中中風險關鍵字的數量 
-            'medium_risk_keyword_count': len(self.medium_risk_set.intersection(word_set)), 
-            # 計算文本中低風險關鍵字的數量 
-            'low_risk_keyword_count': len(self.low_risk_set.intersection(word_set)) 
-        }
+        if self._keyword_automaton is None: # 沒有任何負面關鍵字 
+            return 0, 0, 0 
+        counts = [0, 0, 0] # 高、中、低風險關鍵字的數量 
+        seen = set() # 已計算過的關鍵字 ID，同一個關鍵字重複出現時不重複計算 
+        for _, (keyword_id, levels) in self._keyword_automaton.iter_long(text): 
+            if keyword_id in seen: 
+                continue 
+            seen.add(keyword_id) 
+            for level in levels: 
+                counts[level] += 1 
+        return counts[0], counts[1], counts[2] 
 
-    def _extract_key_phrases(self, text: str) -> dict:
+    def _extract_key_phrases(self, text: str) -> tuple[list, list]:
         """ 私有方法：從評論文本中摘錄代表性的正面和負面關鍵片語。 
+            回傳 (正面片語列表, 負面片語列表)。 
         """
         positive_phrases = [] # 初始化一個空列表，用於儲存摘錄到的正面片語 
         negative_phrases = [] # 初始化一個空列表，用於儲存摘錄到的負面片語 
         
-        # 使用正規表達式將評論文本拆分為獨立的句子。分句符包括逗號、句號、問號、感嘆號和換行符 
-        sentences = re.split(r'[，。！？,!?\n]', text) 
+        # 使用預先編譯的正規表達式將評論文本拆分為獨立的句子 
+        sentences = self._SENT_SPLIT.split(text) 
         
         for sentence in sentences: # 遍歷拆分後的所有句子 
+            if len(negative_phrases) >= 3 and len(positive_phrases) >= 2: # 正面和負面片語都已達到上限，剩下的句子不需要再檢查 
+                break 
             sentence = sentence.strip() # 移除句子兩端的空白字元 
             if not sentence: continue # 如果句子處理後為空，則跳過當前循環 
             
-            # 先檢查負面關鍵字，優先摘錄負面信息 (最多 3 句) 
-            found_negative = False # 初始化一個布林變數，標記是否在當前句子中找到負面關鍵字 
-            if len(negative_phrases) < 3: # 如果負面片語的數量還未達到上限（最多 3 句） 
-                for keyword in self.all_negative_set: # 遍歷所有負面關鍵字集合中的詞語 
-                    if keyword in sentence: # 如果當前關鍵字存在於句子中 
-                        negative_phrases.append(sentence) # 將整個句子添加到負面片語列表 
-                        found_negative = True # 標記已找到負面詞 
-                        break # 找到一個負面詞後就跳出內部循環，避免重複添加或過度搜索 
+            # 先檢查負面關鍵字，優先摘錄負面信息 (最多 3 句)。負面片語的數量還未達到上限時，才檢查句子是否包含任一負面關鍵字 
+            found_negative = len(negative_phrases) < 3 and self._contains_keyword(sentence, self._keyword_automaton) 
+            if found_negative: 
+                negative_phrases.append(sentence) # 將整個句子添加到負面片語列表 
             
             # 只有在「沒有」找到負面詞的情況下，才檢查正面關鍵字 (最多 2 句) 
-            if not found_negative and len(positive_phrases) < 2: # 如果未找到負面詞且正面片語數量還未達到上限（最多 2 句） 
-                for keyword in self.positive_set: # 遍歷所有正面關鍵字集合中的詞語 
-                    if keyword in sentence: # 如果當前關鍵字存在於句子中 
-                        positive_phrases.append(sentence) # 將整個句子添加到正面片語列表 
-                        break # 找到一個正面詞後就跳出內部循環 
+            elif len(positive_phrases) < 2 and self._contains_keyword(sentence, self._positive_automaton): 
+                positive_phrases.append(sentence) # 將整個句子添加到正面片語列表 
         
-        return {"positive": positive_phrases, "negative": negative_phrases} # 回傳包含正面和負面片語列表的字典 
+        return positive_phrases, negative_phrases # 回傳正面和負面片語列表 
         # 注意：原代碼這裡有一個重複的 `return` 語句，實際執行時只有第一個會被觸發，第二個是多餘的。
 
+    def _compute_review_features(self, texts: np.ndarray, stale: np.ndarray) -> tuple[list, list, list, list, list]:
+        """ 私有方法：在同一次走訪中計算每條評論的關鍵字數量並摘錄關鍵片語。 
+            `stale` 為與 `texts` 等長的布林陣列，為 True 的評論才需要重新計算關鍵字數量。 
+            回傳 (高風險數量列表, 中風險數量列表, 低風險數量列表, 正面片語列表, 負面片語列表)； 
+            數量列表只包含 `stale` 為 True 的評論，順序與輸入一致。 
+        """
+        high, medium, low = [], [], [] 
+        all_positive, all_negative = [], [] 
+        for text, is_stale in zip(texts, stale): 
+            if is_stale: 
+                h, m, l = self._calculate_f2_keywords(text) 
+                high.append(h) 
+                medium.append(m) 
+                low.append(l) 
+            positive, negative = self._extract_key_phrases(text) 
+            all_positive.extend(positive) 
+            all_negative.extend(negative) 
+        return high, medium, low, all_positive, all_negative 
+
+    @staticmethod
+    def _to_features(df: pd.DataFrame | None) -> dict:
+        """ 私有方法：將處理後的 DataFrame 轉換為計分器使用的特徵字典 (每個欄位一個 NumPy 陣列)。 
+            傳入 None 時回傳長度為 0 的陣列，代表沒有可分析的評論。 
+        """
+        if df is None: # 沒有任何評論時，所有特徵皆為空陣列 
+            return {"high_risk": np.empty(0, dtype=np.int16), "medium_risk": np.empty(0, dtype=np.int16), "low_risk": np.empty(0, dtype=np.int16), "sentiment": np.empty(0, dtype=np.float32)}
+        return {
+            "high_risk": df['high_risk_keyword_count'].to_numpy(), # 每條評論的高風險關鍵字數量 
+            "medium_risk": df['medium_risk_keyword_count'].to_numpy(), # 每條評論的中風險關鍵字數量 
+            "low_risk": df['low_risk_keyword_count'].to_numpy(), # 每條評論的低風險關鍵字數量 
+            "sentiment": df['sentiment_score'].to_numpy() # 每條評論的情感分數（float32，計分器計算平均值後才轉為 Python float） 
+        }
+
+    @staticmethod
+    def _is_trend_fresh(trend_info: dict | None) -> bool:
+        """ 私有方法：判斷儲存在地點文件上的趨勢資訊是否可以直接沿用。 
+            必須是以目前的 FEATURES_VERSION 計算，且計算時間在 TREND_CACHE_SECONDS 之內。 
+        """
+        if not trend_info: # 沒有儲存過趨勢資訊 
+            return False 
+        return (trend_info.get('features_version') == FEATURES_VERSION 
+                and time.time() - trend_info.get('computed_at', 0) < TREND_CACHE_SECONDS) 
+
     def _calculate_f3_trend(self, df: pd.DataFrame, place_info: dict) -> dict:
         """ 私有方法：計算 F3 - 近期趨勢惡化分數。 
             評估地點近期評論評分與歷史平均評分的趨勢。 
         """
-        from datetime import datetime, timedelta, timezone # 導入日期時間相關模組，用於時間計算 
-
         # 獲取地點的歷史平均評分。如果 `place_info` 中有 `totalScore` 字段則用其值，否則計算 DataFrame 中 'rating' 欄位的平均值 
         historical_avg_rating = place_info.get('totalScore', df['rating'].mean()) 
-        # 計算 90 天前的時間點。`datetime.now(timezone.utc)` 獲取當前 UTC 時間，`timedelta(days=90)` 定義 90 天的間隔 
-        ninety_days_ago = datetime.now(timezone.utc) - timedelta(days=90) 
-        # 過濾出近 90 天內的評論數據 
-        recent_reviews = df[df['datetime'] >= ninety_days_ago] 
+        # 計算 90 天前的時間點。`datetime.now(timezone.utc)` 獲取當前 UTC 時間，再減去預先建立的 90 天間隔 
+        ninety_days_ago = datetime.now(timezone.utc) - _NINETY_DAYS 
+        # 過濾出近 90 天內的評論評分。全程使用底層的 NumPy 陣列：日期為 datetime64 陣列（UTC），以布林遮罩直接取出評分，不經過 DataFrame 索引 
+        recent_mask = df['datetime'].values >= np.datetime64(ninety_days_ago.replace(tzinfo=None), 'ns') 
+        recent_ratings = df['rating'].to_numpy()[recent_mask] 
         
-        if len(recent_reviews) > 5: # 如果近 90 天的評論數量大於 5 筆（認為有足夠數據計算趨勢） 
-            recent_avg_rating = recent_reviews['rating'].mean() # 計算近期評論的平均評分 
+        if recent_ratings.size > 5: # 如果近 90 天的評論數量大於 5 筆（認為有足夠數據計算趨勢） 
+            recent_avg_rating = float(recent_ratings.mean()) # 計算近期評論的平均評分 
             trend_score = historical_avg_rating - recent_avg_rating # 計算趨勢分數 (歷史平均 - 近期平均)。正數表示近期評分下降（趨勢惡化） 
         else: # 如果近期評論數量不足 5 筆 
             recent_avg_rating = None # 將近期平均評分設為 None 
@@ -127,84 +263,155 @@ class FeatureEngineer:
             "trend_score": round(trend_score, 3) # 四捨五入到小數點後三位 
         }
 
-    def run(self, place_info: dict) -> tuple[pd.DataFrame | None, dict | None, dict | None]:
+    def materialize_review_features(self, reviews_list: list[dict]) -> None:
+        """
+        公開方法：在評論寫入資料庫前，預先計算每條評論的特徵並直接寫入評論字典。 
+        包含以批次方式呼叫 Azure 計算的 'sentiment_score'，以及三層級關鍵字計數與 'features_version'，
+        讓之後的快取命中不需要再呼叫外部 API 或重新計算關鍵字。 
+        沒有文本（或只有空白）的評論會被略過，它們在 `run()` 中也會被清洗掉。 
+        未能取得情感分數的評論（Azure 未設定或分析失敗）不會寫入 'sentiment_score'，讓 `run()` 之後重新分析。 
+        Args:
+            reviews_list (list[dict]): Apify 回傳的原始評論列表，會被原地修改。 
+        """
+        # 只分析有實際文本內容的評論 
+        scorable = [review for review in reviews_list if isinstance(review.get('text'), str) and review['text'].strip()] 
+        # 批次取得情感分數，順序與輸入一致；失敗的分數為 None，而不是中性分數 0.0，避免將失敗結果永久存入資料庫 
+        scores = get_sentiment_scores([review['text'] for review in scorable], default=None) 
+        for review, score in zip(scorable, scores): # 將分數與關鍵字計數寫回對應的評論 
+            if score is not None: 
+                review['sentiment_score'] = score 
+            review.update(zip(KEYWORD_COUNT_FIELDS, self._calculate_f2_keywords(review['text']))) # 三層級關鍵字計數 
+            review['features_version'] = FEATURES_VERSION # 標記這些特徵是以哪個版本計算的 
+
+    @staticmethod
+    def _load_reviews(reviews, place_id: str | None = None) -> pa.Table:
+        """ 私有方法：將評論轉換為符合 REVIEW_SCHEMA 的 Arrow Table。 
+            `reviews` 可以是評論字典列表，或是 `scripts/run_apify_actor.py` 輸出的 Parquet 檔案路徑。 
+            讀取 Parquet 時只會從磁碟讀取特徵工程需要的欄位，並跳過 JSON 解析。 
+            Parquet 檔案可能包含多個地點的評論（例如搜尋夜市時的多個攤位），此時以 `place_id` 篩選 'placeId' 欄位， 
+            篩選條件會下推到 Parquet 讀取，不屬於該地點的資料列不會被載入。 
+        """
+        if isinstance(reviews, str) and reviews.endswith('.parquet'): 
+            available = set(pq.read_schema(reviews).names) # 只讀取檔案的結構描述，不讀取數據 
+            filters = None 
+            if 'placeId' in available: 
+                if place_id is not None: 
+                    filters = [('placeId', '==', place_id)] # 只讀取這個地點的評論 
+                elif len(pc.unique(pq.read_table(reviews, columns=['placeId'])['placeId'])) > 1: 
+                    # 未指定地點時，不能將多個地點的評論當成同一個地點計分 
+                    raise ValueError(f"{reviews} 包含多個地點的評論，請在 place_info 中提供 'placeId'。") 
+            table = pq.read_table(reviews, columns=[name for name in REVIEW_SCHEMA.names if name in available], filters=filters) 
+            for field in REVIEW_SCHEMA: # 檔案中沒有的欄位以 null 補上 
+                if field.name not in available: 
+                    table = table.append_column(field, pa.nulls(table.num_rows, field.type)) 
+            return table.select(REVIEW_SCHEMA.names).cast(REVIEW_SCHEMA) 
+        # 依照明確的結構一次轉換整個評論列表，不需要 pandas 推斷每個欄位的型別 
+        return pa.Table.from_pylist(reviews, schema=REVIEW_SCHEMA) 
+
+    def run(self, place_info: dict) -> tuple[dict | None, dict | None, dict | None]:
         """
         公開方法：執行完整的特徵工程 Pipeline。 
-        接收地點資訊 (包含評論列表)，處理後回傳處理後的 DataFrame、趨勢數據和關鍵片語。 
+        接收地點資訊 (包含評論列表)，處理後回傳逐評論特徵、趨勢數據和關鍵片語。 
         Args:
             place_info (dict): 包含地點及其評論的字典數據，通常來自 Apify 抓取結果或資料庫快取。 
+                其中的 'reviews' 也可以是評論 Parquet 檔案的路徑，此時以 'placeId' 選取該地點的評論。 
         Returns:
-            tuple[pd.DataFrame | None, dict | None, dict | None]: 
-                - 處理後的評論 DataFrame (pd.DataFrame)。 
+            tuple[dict | None, dict | None, dict | None]: 
+                - 逐評論特徵字典 (dict)，鍵為 "high_risk"、"medium_risk"、"low_risk"、"sentiment"，值為 NumPy 陣列。 
                 - 趨勢資訊字典 (dict)。 
                 - 關鍵片語字典 (dict)。 
                 如果處理過程中遇到關鍵錯誤（如缺少必要欄位），則可能回傳 None。 
         """
         print("INFO: 開始進行進階特徵工程...") 
         
-        reviews_list = place_info.get('reviews', []) # 從 `place_info` 字典中安全地獲取 'reviews' 列表，如果不存在則默認為空列表 
+        reviews_list = place_info.get('reviews', []) # 從 `place_info` 字典中安全地獲取 'reviews' 列表（或 Parquet 路徑），如果不存在則默認為空列表 
         if not reviews_list: # 如果評論列表為空 
-            return pd.DataFrame(), {}, {} # 回傳空的 DataFrame 和空字典，表示沒有數據可供分析 
+            return self._to_features(None), {}, {} # 回傳空的特徵和空字典，表示沒有數據可供分析 
 
-        df = pd.DataFrame(reviews_list) # 將評論列表轉換為 Pandas DataFrame，便於數據操作 
-        # 定義原始數據欄位名稱與我們內部使用名稱的映射關係 
-        required_cols = {'stars': 'rating', 'text': 'text', 'publishedAtDate': 'datetime_str'} 
+        table = self._load_reviews(reviews_list, place_info.get('placeId')) # 將評論轉換為 Arrow Table 
         
-        # 檢查 DataFrame 是否包含所有必要的原始欄位 
-        if not all(col in df.columns for col in required_cols.keys()): 
+        # 檢查是否包含所有必要的原始欄位（所有評論都沒有該欄位時，整欄皆為 null） 
+        if any(table[col].null_count == table.num_rows for col in REQUIRED_REVIEW_COLUMNS): 
             # 如果缺少任何一個必要欄位，則回傳 None，表示處理失敗 
             return None, None, None 
             
-        # 選取必要欄位，並移除包含空值的行 (`dropna()`) 
-        df = df[list(required_cols.keys())].dropna() 
-        # 重新命名選定的欄位為我們內部使用的名稱，`inplace=True` 表示直接在原 DataFrame 上修改 
-        df.rename(columns=required_cols, inplace=True) 
-        # 過濾掉評論文本為空或只包含空白字元的行。`.str.strip()` 移除文本兩端空白，然後檢查是否為空字串 
-        df = df[df['text'].str.strip() != ''].copy() # `.copy()` 避免 Pandas 的 SettingWithCopyWarning 
-        if df.empty: # 如果數據清洗後 DataFrame 變為空 
-            return pd.DataFrame(), {}, {} # 回傳空的 DataFrame 和空字典 
-        # 將 'datetime_str' 欄位（原始的日期時間字串）轉換為 Pandas 的 datetime 對象，便於後續日期時間計算 
-        df['datetime'] = pd.to_datetime(df['datetime_str']) 
+        # 以 Arrow 的向量化運算一次完成清洗：移除必要欄位中包含空值的行，以及評論文本為空或只包含空白字元的行。
+        # 空白檢查使用 `utf8_is_space`（全部為空白字元時為 True，空字串為 False），直接掃描原始文本而不產生去除空白後的新字串。
+        # 文本為 null 時檢查結果也是 null，`filter` 會一併將其移除 
+        text = table['text'] 
+        keep = pc.and_(
+            pc.and_(pc.is_valid(table['stars']), pc.is_valid(table['publishedAtDate'])), 
+            pc.and_(pc.greater(pc.utf8_length(text), 0), pc.invert(pc.utf8_is_space(text))) 
+        )
+        table = table.filter(keep) 
+        if table.num_rows == 0: # 如果數據清洗後沒有任何評論 
+            return self._to_features(None), {}, {} # 回傳空的特徵和空字典 
+        # 星級轉為 int8（1 到 5 星只需 1 個位元組，F1 / F3 的比較與平均都在較小的陣列上進行）；日期字串轉為 UTC 時間戳記，便於後續日期時間計算 
+        table = table.set_column(table.schema.get_field_index('stars'), 'stars', pc.cast(table['stars'], pa.int8())) 
+        table = table.set_column(table.schema.get_field_index('publishedAtDate'), 'publishedAtDate', pc.cast(table['publishedAtDate'], pa.timestamp('ns', 'UTC'))) 
+        # 重新命名為我們內部使用的名稱，並轉換為 Pandas DataFrame 
+        df = table.rename_columns([REQUIRED_REVIEW_COLUMNS.get(name, name) for name in table.column_names]).to_pandas() 
         print("INFO: 數據清洗完成。") 
 
         # --- AI 特徵計算 ---
         # 調用私有方法 `_calculate_f1_depth`，為 DataFrame 添加 'is_negative' 和 'is_long_review' 欄位 
         df = self._calculate_f1_depth(df) 
 
-        print("INFO: 正在進行 Jieba 斷詞與關鍵字分析...") 
-        # 對 DataFrame 的 'text' 欄位應用 `_calculate_f2_keywords_jieba` 方法。
-        # `.apply(pd.Series)` 會將每個調用返回的字典（包含三種關鍵字計數）展開成 DataFrame 的新欄位 
-        keyword_counts = df['text'].apply(self._calculate_f2_keywords_jieba).apply(pd.Series) 
-        # 將新生成的關鍵字計數欄位與原 DataFrame 合併，`axis=1` 表示按列合併 
-        df = pd.concat([df, keyword_counts], axis=1) 
-        print("INFO: 關鍵字分析完成。") 
-
-        print("INFO: 正在進行 Azure AI 情感分析...") 
-        # 對 DataFrame 的 'text' 欄位應用 `get_sentiment_score` 函數，獲取每條評論的情感分數，並儲存到 'sentiment_score' 欄位 
-        df['sentiment_score'] = df['text'].apply(get_sentiment_score) 
-        print("INFO: 情感分析完成。") 
+        # 只有缺少關鍵字計數、或計數是以舊版本計算的評論才需要重新計算 
+        if 'features_version' in df.columns and all(col in df.columns for col in KEYWORD_COUNT_FIELDS): 
+            stale_keywords = (df['features_version'] != FEATURES_VERSION) | df[KEYWORD_COUNT_FIELDS].isna().any(axis=1) 
+        else: 
+            stale_keywords = pd.Series(True, index=df.index) 
+        print("INFO: 正在進行關鍵字分析與片語摘錄...") 
+        # 對每條評論計算關鍵字數量（只計算需要重新計算的評論）並摘錄正面和負面片語，各自收集到單一列表中 
+        # （比 `.apply(pd.Series)` 將每個結果包裝成 Series 再組回 DataFrame 快得多） 
+        texts = df['text'].to_numpy() 
+        stale = stale_keywords.to_numpy() 
+        high, medium, low, all_positive, all_negative = self._compute_review_features(texts, stale) 
+        for col, counts in zip(KEYWORD_COUNT_FIELDS, (high, medium, low)): 
+            if stale.all(): 
+                # 所有評論都重新計算時（例如新爬取的評論），直接以新陣列取代整個欄位，不需要逐列對齊寫入 
+                df[col] = np.asarray(counts, dtype=np.int16) 
+            else: 
+                if stale.any(): # 只將新計算的計數寫回需要重新計算的評論 
+                    df.loc[stale_keywords, col] = counts 
+                df[col] = df[col].to_numpy(dtype=np.int16) # 關鍵字數量很小，使用 int16 即可 
+        print("INFO: 關鍵字分析與片語摘錄完成。") 
+
+        # 已在寫入資料庫前計算過的情感分數會直接沿用，只有缺少分數的評論才需要呼叫 Azure 
+        if 'sentiment_score' not in df.columns: 
+            df['sentiment_score'] = np.nan 
+        df['sentiment_score'] = df['sentiment_score'].astype(float) # 確保欄位為浮點數（缺少的值為 NaN） 
+        missing_sentiment = df['sentiment_score'].isna() # 標記缺少情感分數的評論 
+        if missing_sentiment.any(): 
+            print("INFO: 正在進行 Azure AI 情感分析...") 
+            # 只將不重複的評論文本以批次方式送出情感分析（每 10 條一個請求），再依文本將分數對應回每條評論 
+            missing_texts = df.loc[missing_sentiment, 'text'] 
+            unique_texts = missing_texts.drop_duplicates().tolist() 
+            mapping = dict(zip(unique_texts, get_sentiment_scores(unique_texts))) 
+            df.loc[missing_sentiment, 'sentiment_score'] = missing_texts.map(mapping) 
+            print("INFO: 情感分析完成。") 
+        df['sentiment_score'] = df['sentiment_score'].to_numpy(dtype=np.float32) # 情感分數範圍為 -1 到 1，使用 float32 即可 
         
-        print("INFO: 正在摘錄代表性評論片語...") 
-        # 對 DataFrame 的 'text' 欄位應用 `_extract_key_phrases` 方法，從每條評論中摘錄正面和負面片語 
-        phrases_df = df['text'].apply(self._extract_key_phrases).apply(pd.Series) 
-        # 將所有評論中摘錄的正面片語列表扁平化為一個單一列表 
-        all_positive = [item for sublist in phrases_df['positive'] for item in sublist] 
-        # 將所有評論中摘錄的負面片語列表扁平化為一個單一列表 
-        all_negative = [item for sublist in phrases_df['negative'] for item in sublist] 
-        # 構建最終的關鍵片語字典。`dict.fromkeys` 用於去重，然後再轉回列表，並限制數量 
+        # 構建最終的關鍵片語字典。只取前幾個不重複的片語，取滿後即停止，不需要對所有片語去重 
         key_phrases = {
-            "positive_points": list(dict.fromkeys(all_positive))[:2], # 取前 2 個不重複的正面片語 
-            "key_negative_keywords": list(dict.fromkeys(all_negative))[:3] # 取前 3 個不重複的負面片語 
+            "positive_points": _first_unique(all_positive, 2), # 取前 2 個不重複的正面片語 
+            "key_negative_keywords": _first_unique(all_negative, 3) # 取前 3 個不重複的負面片語 
         }
-        print("INFO: 片語摘錄完成。") 
 
-        # 調用私有方法 `_calculate_f3_trend`，計算並獲取趨勢相關的數據 
-        trend_data = self._calculate_f3_trend(df, place_info) 
-        
-        # 將原始地點資訊中的評論總數和分佈信息添加到 `trend_data` 字典中 
-        trend_data['total_reviews'] = place_info.get('reviewsCount', 0) 
-        trend_data['reviews_distribution'] = place_info.get('reviewsDistribution', {}) 
+        cached_trend = place_info.get('trend_info') # 先前儲存在地點文件上的趨勢資訊（如果有） 
+        if self._is_trend_fresh(cached_trend): 
+            trend_data = dict(cached_trend['data']) # 在有效期間內且版本相同，直接沿用 
+        else: 
+            # 調用私有方法 `_calculate_f3_trend`，計算並獲取趨勢相關的數據 
+            trend_data = self._calculate_f3_trend(df, place_info) 
+            
+            # 將原始地點資訊中的評論總數和分佈信息添加到 `trend_data` 字典中 
+            trend_data['total_reviews'] = place_info.get('reviewsCount', 0) 
+            trend_data['reviews_distribution'] = place_info.get('reviewsDistribution', {}) 
+            # 將新的趨勢資訊寫回 `place_info`，呼叫端可將其存回地點文件供下次沿用 
+            place_info['trend_info'] = {"data": trend_data, "features_version": FEATURES_VERSION, "computed_at": time.time()} 
 
         print("INFO: 進階特徵工程已全部完成。") 
-        # 回傳處理後的 DataFrame、趨勢數據字典和關鍵片語字典 
-        return df, trend_data, key_phrases 
\ No newline at end of file
+        # 回傳逐評論特徵字典、趨勢數據字典和關鍵片語字典 
+        return self._to_features(df), trend_data, key_phrases 
\ No newline at end of file
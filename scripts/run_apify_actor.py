@@ -1,7 +1,8 @@
 import os # 導入 os 模組，用於與作業系統進行交互，例如讀取環境變數和處理文件路徑。
 import requests # 導入 requests 庫，這是一個流行的 Python 庫，用於發送 HTTP 請求（例如 GET, POST 等）。
 import time # 導入 time 模組，提供時間相關的功能，例如 `time.sleep()` 用於暫停程式執行。
-import json # 導入 json 模組，用於處理 JSON (JavaScript Object Notation) 格式的數據，包括編碼和解碼。
+import json # 導入 json 模組，用於逐行解析下載的 JSONL 數據。
+import pandas as pd # 導入 pandas 庫，用於將評論數據寫入 Parquet 檔案。
 from dotenv import load_dotenv # 從 dotenv 庫導入 load_dotenv 函數。這個函數用於從 `.env` 檔案中載入環境變數到程式的執行環境中。
 
 # --- 1. 初始化與環境設定 ---
@@ -22,6 +23,44 @@ ACTOR_ID = "compass~crawler-google-places" # 定義 Apify 平台上 Google Maps
 # Apify API 的基礎 URL
 BASE_API_URL = "https://api.apify.com/v2" # 定義 Apify API 的基礎 URL。所有 Apify API 請求都將以此 URL 為前綴。
 
+# 查詢任務狀態時，讓 Apify 伺服器最多等待的秒數（Apify 允許的上限為 60 秒）。任務狀態一改變，請求就會立即回傳。
+WAIT_FOR_FINISH_SECONDS = 60
+# 查詢任務狀態時允許連續失敗的次數，以及每次失敗後重試前等待的秒數。
+MAX_STATUS_RETRIES = 3
+STATUS_RETRY_DELAY = 5
+
+# 寫入 Parquet 檔案的評論欄位：特徵工程讀取的欄位，以及用於識別評論與地點的欄位。
+PARQUET_REVIEW_COLUMNS = ["placeId", "reviewId", "stars", "text", "publishedAtDate"]
+
+# 所有請求共用同一個 Session，重用與 api.apify.com 之間已建立的 TCP/TLS 連線。
+session = requests.Session()
+
+
+def write_reviews_parquet(jsonl_path: str, parquet_path: str):
+    """
+    將下載的 JSONL 數據中所有地點的評論攤平，並以 snappy 壓縮的 Parquet 格式儲存。
+    Parquet 是欄式格式，`FeatureEngineer.run` 讀取時只需從磁碟讀取需要的欄位，且不需要解析 JSON。
+    一個檔案可能包含多個地點的評論，`FeatureEngineer.run` 會以地點資訊中的 'placeId' 只讀取該地點的評論。
+
+    Args:
+        jsonl_path (str): `run_and_get_reviews` 下載的 JSONL 檔案路徑。
+        parquet_path (str): Parquet 檔案要儲存的本地路徑。
+    """
+    rows = [] # 所有地點的評論。
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f: # 每行是一個地點（包含其評論列表）。
+            if not line.strip():
+                continue
+            place = json.loads(line)
+            for review in place.get("reviews") or []:
+                # 評論本身不含地點 ID，因此從地點資訊中補上。
+                rows.append({**review, "placeId": place.get("placeId")})
+    df = pd.DataFrame(rows)
+    # 只保留固定的純量欄位；其他欄位（圖片列表、巢狀物件等）結構不固定，不適合寫入 Parquet。
+    df = df[[col for col in PARQUET_REVIEW_COLUMNS if col in df.columns]]
+    df.to_parquet(parquet_path, compression="snappy", index=False)
+    print(f"SUCCESS: {len(df)} 則評論已儲存為 Parquet 檔案 {parquet_path}")
+
 
 def run_and_get_reviews(search_term: str, output_path: str, max_reviews: int = 50):
     """
@@ -30,7 +69,8 @@ def run_and_get_reviews(search_term: str, output_path: str, max_reviews: int = 5
     Args:
         search_term (str): 要在 Google Maps 上搜尋的關鍵字，例如 "基隆廟口夜市"。
                            這是 Actor 任務的輸入，用於指定要抓取評論的地點。
-        output_path (str): 下載的 JSON 數據要儲存的本地路徑。
+        output_path (str): 下載的 JSONL 數據（每行一個 JSON 物件）要儲存的本地路徑。
+                           評論另外會以 Parquet 格式儲存在相同路徑、副檔名為 `.parquet` 的檔案中。
                            指定抓取到的評論數據在本地文件系統中的保存位置。
         max_reviews (int): 希望抓取的最大評論數量。默認為 50 條。
                            這個參數限制了 Actor 嘗試抓取的評論條數，有助於控制成本和執行時間。
@@ -52,7 +92,7 @@ def run_and_get_reviews(search_term: str, output_path: str, max_reviews: int = 5
 
     try:
         # 透過 HTTP POST 請求啟動 Actor 任務
-        run_response = requests.post( # 使用 requests.post 發送 POST 請求。
+        run_response = session.post( # 使用共用的 Session 發送 POST 請求。
             f"{BASE_API_URL}/acts/{ACTOR_ID}/runs?token={APIFY_API_TOKEN}", # 請求的 URL，包含 Apify API 基礎 URL、Actor ID 和 API Token。
             json=actor_input # 將 `actor_input` 字典作為 JSON 格式的請求體發送。requests 庫會自動處理 JSON 編碼。
         )
@@ -68,11 +108,18 @@ def run_and_get_reviews(search_term: str, output_path: str, max_reviews: int = 5
         print(f"錯誤：啟動 Apify Actor 失敗。錯誤訊息: {e}") # 打印啟動失敗的錯誤訊息。
         return # 失敗則返回，不繼續執行後續步驟。
 
-    # --- 3. 輪詢任務狀態，直到完成 ---
-    while True: # 進入一個無限循環，用於定期查詢 Actor 任務的狀態，直到任務完成。
+    # --- 3. 以長輪詢 (long-poll) 等待任務完成 ---
+    failures = 0 # 連續查詢失敗的次數。
+    while True: # 進入一個無限循環，查詢 Actor 任務的狀態，直到任務完成。
         try:
             print(f"INFO: 正在查詢任務 {run_id} 的狀態...") # 打印提示訊息，告知正在查詢任務狀態。
-            status_response = requests.get(f"{BASE_API_URL}/acts/{ACTOR_ID}/runs/{run_id}?token={APIFY_API_TOKEN}") # 發送 GET 請求查詢特定運行 ID 的任務狀態。
+            # `waitForFinish` 讓 Apify 伺服器保持請求最多 60 秒，任務一結束就立即回傳，
+            # 因此不需要在兩次查詢之間自行等待。`timeout` 需大於伺服器端的等待時間。
+            status_response = session.get(
+                f"{BASE_API_URL}/actor-runs/{run_id}",
+                params={"token": APIFY_API_TOKEN, "waitForFinish": WAIT_FOR_FINISH_SECONDS},
+                timeout=WAIT_FOR_FINISH_SECONDS + 30
+            )
             status_response.raise_for_status() # 檢查狀態查詢請求的回應是否成功。
             status_data = status_response.json() # 解析狀態查詢的回應 JSON。
             status = status_data['data']['status'] # 從回應數據中提取任務的當前狀態字串（例如 "RUNNING", "SUCCEEDED"）。
@@ -82,33 +129,39 @@ def run_and_get_reviews(search_term: str, output_path: str, max_reviews: int = 5
             # 當任務狀態為最終狀態 (成功、失敗、中止) 時，跳出迴圈
             if status in ["SUCCEEDED", "FAILED", "TIMED-OUT", "ABORTED"]: # 檢查當前狀態是否為任務的最終狀態。
                 break # 如果是最終狀態，則跳出 while 循環。
-            
-            # 等待 15 秒後再進行下一次查詢，避免過於頻繁地請求 API
-            time.sleep(15) # 暫停程式執行 15 秒，以避免頻繁請求 Apify API 導致達到速率限制或增加不必要的負載。
+            failures = 0 # 查詢成功，重設連續失敗次數。
 
         except requests.exceptions.RequestException as e: # 捕獲查詢任務狀態時可能發生的請求異常。
-            print(f"錯誤：查詢任務狀態失敗。錯誤訊息: {e}") # 打印錯誤訊息。
-            return # 失敗則返回。
+            failures += 1
+            print(f"錯誤：查詢任務狀態失敗 ({failures}/{MAX_STATUS_RETRIES})。錯誤訊息: {e}") # 打印錯誤訊息。
+            if failures >= MAX_STATUS_RETRIES: # 連續失敗太多次，放棄等待。
+                return # 失敗則返回。
+            time.sleep(STATUS_RETRY_DELAY) # 只在發生暫時性錯誤時短暫等待後重試。
 
     # --- 4. 根據最終狀態下載結果 ---
     if status == "SUCCEEDED": # 如果任務的最終狀態是 "SUCCEEDED" (成功完成)
         print("INFO: 任務成功完成！正在下載數據集...") # 打印成功訊息。
         try:
-            # 從數據集端點獲取所有項目
-            dataset_response = requests.get(f"{BASE_API_URL}/datasets/{dataset_id}/items?token={APIFY_API_TOKEN}") # 發送 GET 請求從 Apify 數據集下載所有項目。
-            dataset_response.raise_for_status() # 檢查數據集下載請求的回應是否成功。
-            reviews_data = dataset_response.json() # 解析下載到的 JSON 數據，這將是評論數據的列表。
-            
             # 確保輸出目錄存在。如果目錄不存在，則創建它。`exist_ok=True` 表示如果目錄已經存在，則不會拋出錯誤。
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            # 將獲取的數據以美觀的格式寫入本地 JSON 檔案
-            with open(output_path, 'w', encoding='utf-8') as f: # 以寫入模式 ('w') 打開指定的輸出文件，使用 UTF-8 編碼。
-                json.dump(reviews_data, f, ensure_ascii=False, indent=2) # 將 `reviews_data` 寫入文件，格式為 JSON。
-                                                                          # `ensure_ascii=False` 允許直接寫入非 ASCII 字元（如中文）。
-                                                                          # `indent=2` 使 JSON 輸出格式化，易於閱讀，每層縮排 2 個空格。
+            # 以 JSONL 格式（每行一個項目）串流下載數據集，並將收到的位元組直接寫入檔案，
+            # 不需要在記憶體中保留整個回應，也不需要解析後再重新編碼。
+            temp_path = f"{output_path}.part" # 先寫入暫存檔，下載完成後才改名，避免中斷時留下不完整的輸出檔案。
+            with session.get(
+                f"{BASE_API_URL}/datasets/{dataset_id}/items",
+                params={"token": APIFY_API_TOKEN, "format": "jsonl"},
+                stream=True
+            ) as dataset_response: # 發送 GET 請求從 Apify 數據集串流下載所有項目。
+                dataset_response.raise_for_status() # 檢查數據集下載請求的回應是否成功。
+                with open(temp_path, 'wb') as f: # 以二進位寫入模式打開暫存檔，Apify 回傳的已是 UTF-8 編碼的內容。
+                    for chunk in dataset_response.iter_content(chunk_size=65536): # 每次讀取最多 64 KB。
+                        f.write(chunk)
+            os.replace(temp_path, output_path) # 下載完成後，將暫存檔改名為正式的輸出檔案。
                 
             print(f"SUCCESS: 數據已成功下載並儲存至 {output_path}") # 打印成功下載和保存數據的訊息。
+            # 另外將評論存成 Parquet，供特徵工程直接讀取。
+            write_reviews_parquet(output_path, os.path.splitext(output_path)[0] + ".parquet")
 
         except requests.exceptions.RequestException as e: # 捕獲下載數據集時可能發生的請求異常。
             print(f"錯誤：下載數據集失敗。錯誤訊息: {e}") # 打印錯誤訊息。
@@ -124,7 +177,7 @@ if __name__ == "__main__":
     # 我們可以輕易地更改 search_query 來獲取不同餐廳的數據
     search_query = "基隆廟口夜市" # 定義要用於 Apify Actor 搜尋的關鍵字。
     # 構建輸出檔案的路徑和名稱。將 `search_query` 中的空格替換為底線，以創建一個有效的文件名。
-    output_file_path = f"data/apify_{search_query.replace(' ', '_')}_output.json"
+    output_file_path = f"data/apify_{search_query.replace(' ', '_')}_output.jsonl"
     
     # 執行主函式
     run_and_get_reviews(search_query, output_file_path) # 調用 `run_and_get_reviews` 函數來開始數據抓取過程。
\ No newline at end of file
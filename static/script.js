@@ -96,7 +96,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // 顯示分析中的提示訊息，並包含首次分析可能較長的提示，因為可能需要即時抓取數據
         resultsContainer.innerHTML = '<div class="loader"></div><p>分析中，請稍候... (首次分析可能需要較長時間抓取數據)</p>'; 
         
-        // 步驟三：呼叫後端的 /analyze 端點
+        // 步驟三：呼叫後端的 /analyze 端點建立分析任務，再輪詢任務狀態直到完成
         try {
             const response = await fetch('/analyze', { // 向後端 `/analyze` 端點發送請求 
                 method: 'POST', // 請求方法為 POST，因為它會傳送數據給伺服器 
@@ -110,7 +110,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.detail || `分析伺服器錯誤: ${response.status}`);
             }
             
-            const data = await response.json(); // 如果回應成功，解析 JSON 數據，得到分析結果數據 
+            const job = await response.json(); // 後端以 202 Accepted 回傳任務 ID 與狀態查詢網址 
+            const data = await waitForAnalyzeJob(job.status_url); // 等待背景分析完成，取得分析結果數據 
             // 使用我們原有的函式 `displayResults` 來顯示最終的分析結果卡片
             displayResults(data); 
 
@@ -120,6 +121,25 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // 輔助函式：輪詢分析任務狀態，直到任務成功（回傳結果）或失敗（拋出錯誤）
+    // 後端會在任務逾時後回報失敗；這裡另外限制最長等待時間，避免後端無法回應時無止境地輪詢 
+    const ANALYZE_JOB_MAX_WAIT_MS = 11 * 60 * 1000; 
+    async function waitForAnalyzeJob(statusUrl) {
+        const deadline = Date.now() + ANALYZE_JOB_MAX_WAIT_MS; // 超過此時間仍未完成就放棄等待 
+        while (Date.now() < deadline) {
+            const response = await fetch(statusUrl); // 查詢任務狀態 
+            if (!response.ok) { // 檢查 HTTP 回應狀態碼是否表示成功 (2xx) 
+                const errorData = await response.json(); // 解析錯誤回應的 JSON 數據 
+                throw new Error(errorData.detail || `分析伺服器錯誤: ${response.status}`);
+            }
+            const job = await response.json(); // 解析任務狀態 
+            if (job.status === 'SUCCEEDED') return job.result; // 任務成功，回傳分析結果 
+            if (job.status === 'FAILED') throw new Error(job.error || '分析任務失敗'); // 任務失敗，拋出後端提供的錯誤訊息 
+            await new Promise(resolve => setTimeout(resolve, 2000)); // 任務仍在處理中，等待 2 秒後再查詢 
+        }
+        throw new Error('分析等待逾時，請稍後再試'); // 超過最長等待時間 
+    }
+
     // 函式四：顯示最終的分析結果卡片
     function displayResults(data) {
         // 定義一個函數，用於根據後端返回的分析數據，動態生成並顯示結果卡片